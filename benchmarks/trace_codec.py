@@ -0,0 +1,106 @@
+"""
+benchmark of trace encoding/decoding
+
+    PYTHONPATH=. python benchmarks/trace_codec.py [--traces 200] [--context-words 300] [--repeat 5]
+
+traces come from a prompt | RunnableParallel chain like models/example_model.py with a fake chat model
+"""
+import argparse
+import json
+import time
+import warnings
+from typing import Any, Callable, List
+
+import orjson
+from langchain_core.load import dumpd
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableParallel
+from langchain_core.tracers import BaseTracer
+from langchain_core.tracers.schemas import Run
+
+from research_helper.schemas.run import RunSerializable, dump_serializable
+from research_helper.schemas.trace import TraceListSerializable
+from research_helper.tracer.run_codec import RunCodec
+
+class RunCollector(BaseTracer):
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.runs: List[Run] = []
+
+    def _persist_run(self, run: Run) -> None:
+        self.runs.append(run)
+
+def make_traces(traces: int, context_words: int) -> List[RunSerializable]:
+    prompt = ChatPromptTemplate.from_messages([("system", "answer with the context: {context}"), ("human", "{question}")])
+    model = FakeListChatModel(responses=["answer "*50])
+    chain = prompt | RunnableParallel(a=model | StrOutputParser(), b=model | StrOutputParser())
+
+    collector = RunCollector()
+    for idx in range(traces):
+        chain.invoke({"context": "context "*context_words, "question": f"question {idx}"}, config={"callbacks": [collector]})
+    return [RunSerializable.from_run(run) for run in collector.runs]
+
+def payloads(trace: RunSerializable) -> List[Any]:
+    values, nodes = [], [trace]
+    while nodes:
+        node = nodes.pop()
+        values.extend(node.inputs.values())
+        values.extend((node.outputs or {}).values())
+        nodes.extend(node.child_runs)
+    return values
+
+def measure(func: Callable[[], Any], repeat: int) -> float:
+    """ best of `repeat` in seconds """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter()-start)
+    return best
+
+def report(title: str, results: List[tuple], traces: int) -> None:
+    print(title)
+    baseline = results[0][1]
+    for name, seconds in results:
+        print(f"  {name:<40}{seconds/traces*1e6:10.1f} us/trace  x{baseline/seconds:5.2f}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--traces", type=int, default=200)
+    parser.add_argument("--context-words", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore") # langchain_core.load is in beta
+    traces = make_traces(args.traces, args.context_words)
+    values = [value for trace in traces for value in payloads(trace)]
+    codec = RunCodec()
+    validating_codec = RunCodec(trusted=False)
+
+    report("serialize inputs/outputs", [
+        ("langchain dumpd", measure(lambda: [dumpd(value) for value in values], args.repeat)),
+        ("dump_serializable", measure(lambda: [dump_serializable(value) for value in values], args.repeat)),
+    ], len(traces))
+
+    trace_list = TraceListSerializable(traces=traces)
+    report("encode", [
+        ("TraceLog: model_dump_json(indent=2)", measure(lambda: trace_list.model_dump_json(indent=2), args.repeat)),
+        ("model_dump_json per trace", measure(lambda: [trace.model_dump_json() for trace in traces], args.repeat)),
+        ("orjson per trace", measure(lambda: [orjson.dumps(trace.model_dump()) for trace in traces], args.repeat)),
+        ("RunCodec.dumps", measure(lambda: [codec.dumps(trace) for trace in traces], args.repeat)),
+    ], len(traces))
+
+    document = trace_list.model_dump_json(indent=2)
+    lines = [codec.dumps(trace).encode("utf-8") for trace in traces]
+    report("decode", [
+        ("TraceLog: json.load + validation", measure(lambda: TraceListSerializable(**json.loads(document)), args.repeat)),
+        ("json.loads + validation per trace", measure(lambda: [RunSerializable(**json.loads(line)) for line in lines], args.repeat)),
+        ("model_validate_json per trace", measure(lambda: [RunSerializable.model_validate_json(line) for line in lines], args.repeat)),
+        ("RunCodec(trusted=False).loads", measure(lambda: [validating_codec.loads(line) for line in lines], args.repeat)),
+        ("RunCodec.loads", measure(lambda: [codec.loads(line) for line in lines], args.repeat)),
+    ], len(traces))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import json
+from typing import Any, Dict, Callable, Sequence
+
+from langchain_core.messages.base import BaseMessage
+from langchain_core.prompt_values import PromptValue
+
+from research_helper.schemas.run import RunSerializable
+
+def get_recursively(run: RunSerializable, target: str, prefix="", default: Callable=lambda x: x):
+    # get target from current run
+    targets = getattr(run, target)
+    prefix += run.name if prefix=="" else f"-{run.name}"
+    
+    items = {}
+    if isinstance(targets, dict):
+        for key, item in targets.items():
+            items[prefix+"_"+target+"-"+key] = default(item)
+    else:
+        items[prefix+"_"+target] = default(targets)
+    
+    # aquire target from children
+    for child in run.child_runs:
+        items.update(get_recursively(run=child, target=target, prefix=prefix, default=default))
+    
+    return items
+
+def serialize(target: Any) -> str:
+    if isinstance(target, str):
+        return target
+    elif isinstance(target, BaseMessage):
+        return target.pretty_repr()
+    elif isinstance(target, PromptValue):
+        return target.to_string()
+    elif isinstance(target, Sequence):
+        return [serialize(t) for t in target]
+    else:
+        return str(target)
+
+def to_cell(value: Any) -> Any:
+    """ a serialized value as a single string cell """
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return str(value)
+
+def flatten(run: RunSerializable, default: Callable=serialize) -> Dict[str, Any]:
+    """ one table row of a trace, like {"id": ..., "<run>-<child>_inputs-<key>": ...} """
+    return {
+        "id": run.id,
+        **get_recursively(run, "inputs", default=default),
+        **get_recursively(run, "outputs", default=default),
+    }
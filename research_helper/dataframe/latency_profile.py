@@ -0,0 +1,91 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Tuple
+
+import pandas as pd
+
+from research_helper.schemas.run import RunSerializable
+
+@dataclass
+class NodeLatency:
+    calls: int = 0
+    total_time: float = 0.0 # seconds
+    self_time: float = 0.0 # seconds not covered by any child run
+
+def covered_time(intervals: List[Tuple[float, float]]) -> float:
+    """ length of the union of intervals, children of a RunnableParallel overlap """
+    covered = 0.0
+    end = float("-inf")
+    for start, stop in sorted(intervals):
+        if start >= stop:
+            continue # a child clipped to nothing by its parent
+        if stop > end:
+            covered += stop-max(start, end)
+            end = stop
+    return covered
+
+class LatencyProfile:
+    """
+        self and total time of every node across traces,
+        aggregated by the `<run>-<child>` path of run names like get_recursively
+    """
+
+    def __init__(self) -> None:
+        self._nodes: Dict[Tuple[str, ...], NodeLatency] = {} # keyed by the run names from the root
+        self.traces = 0
+
+    def add(self, run: RunSerializable) -> None:
+        self._count(run, 1)
+
+    def remove(self, run: RunSerializable) -> None:
+        """ take out a trace which was added, so the profile can cover a sliding window of traces """
+        self._count(run, -1)
+
+    def _count(self, run: RunSerializable, sign: int) -> None:
+        self.traces += sign
+        stack: List[Tuple[RunSerializable, Tuple[str, ...]]] = [(run, (run.name,))]
+        while stack:
+            node, path = stack.pop()
+            if node.end_time is None:
+                continue # not finished
+            start, end = node.start_time.timestamp(), node.end_time.timestamp()
+            children = [
+                (max(child.start_time.timestamp(), start), min(child.end_time.timestamp(), end))
+                for child in node.child_runs if child.end_time is not None
+            ]
+
+            latency = self._nodes.setdefault(path, NodeLatency())
+            latency.calls += sign
+            latency.total_time += sign*(end-start)
+            latency.self_time += sign*max(end-start-covered_time(children), 0.0)
+            if latency.calls <= 0:
+                del self._nodes[path]
+            stack.extend((child, (*path, child.name)) for child in node.child_runs)
+
+    def extend(self, runs: Iterable[RunSerializable]) -> None:
+        for run in runs:
+            self.add(run)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """ one row per path, sorted by self time. self_share is relative to the root wall time, so parallel branches may add up above 1 """
+        root_time = sum(latency.total_time for path, latency in self._nodes.items() if len(path) == 1)
+        rows = [
+            {
+                "path": "-".join(path),
+                "calls": latency.calls,
+                "total_time": latency.total_time,
+                "self_time": latency.self_time,
+                "mean_total_time": latency.total_time/latency.calls,
+                "mean_self_time": latency.self_time/latency.calls,
+                "self_share": latency.self_time/root_time if root_time else 0.0,
+            }
+            for path, latency in self._nodes.items()
+        ]
+        columns = ["path", "calls", "total_time", "self_time", "mean_total_time", "mean_self_time", "self_share"]
+        return pd.DataFrame(rows, columns=columns).sort_values("self_time", ascending=False, ignore_index=True)
+
+    def collapsed_stacks(self) -> str:
+        """ `root;child;grandchild <self time in microseconds>` lines for flamegraph.pl, speedscope etc """
+        return "".join(
+            ";".join(name.replace(";", "_") for name in path)+f" {round(latency.self_time*1e6)}\n"
+            for path, latency in self._nodes.items() if round(latency.self_time*1e6) > 0
+        )
@@ -0,0 +1,56 @@
+from typing import Dict, List, Iterator, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from research_helper.dataframe.flatten import flatten, to_cell
+from research_helper.schemas.run import RunSerializable
+from research_helper.tracer.trace_log import TraceLogBase
+
+TIME_COLUMNS = ["start_time", "end_time"]
+
+def _iter_batches(trace_log: TraceLogBase, batch_size: int, stop: int) -> Iterator[List[RunSerializable]]:
+    offset = 0
+    while offset < stop and (batch := trace_log.get_trace(offset=offset, limit=min(batch_size, stop-offset))):
+        yield batch
+        offset += len(batch)
+
+def trace_schema(trace_log: TraceLogBase, batch_size: int = 1024, stop: Optional[int] = None) -> pa.Schema:
+    """ union of the flattened columns of the first `stop` traces, in the order they first appear """
+    columns: Dict[str, None] = {}
+    for batch in _iter_batches(trace_log, batch_size, stop if stop is not None else trace_log.count()):
+        for run in batch:
+            # only the keys are needed, skip serializing the values
+            columns.update(dict.fromkeys(flatten(run, default=lambda x: None)))
+    columns.pop("id", None)
+
+    return pa.schema([
+        ("id", pa.string()),
+        *[(column, pa.timestamp("us", tz="UTC")) for column in TIME_COLUMNS],
+        *[(column, pa.string()) for column in columns],
+    ])
+
+def export_parquet(trace_log: TraceLogBase, path: str, batch_size: int = 1024, compression: str = "zstd") -> int:
+    """
+    stream the traces into a parquet file one record batch at a time,
+    with the same `<run>-<child>_inputs-<key>` columns as the table view
+
+    Returns:
+        int: number of exported traces
+    """
+    # traces added while exporting are left out, their columns are not in the schema
+    stop = trace_log.count()
+    schema = trace_schema(trace_log, batch_size, stop)
+    exported = 0
+    with pq.ParquetWriter(path, schema, compression=compression) as writer:
+        for batch in _iter_batches(trace_log, batch_size, stop):
+            rows = []
+            for run in batch:
+                # every flattened column is a string so that the schema does not depend on the values
+                row = {key: to_cell(value) for key, value in flatten(run).items()}
+                row["id"] = str(run.id)
+                row.update({column: getattr(run, column) for column in TIME_COLUMNS})
+                rows.append(row)
+            writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=schema))
+            exported += len(rows)
+    return exported
@@ -1,2 +1,3 @@
 from .base import Model
-from .noop_model import NoopModel
\ No newline at end of file
+from .noop_model import NoopModel
+from .cached_model import CachedModel
\ No newline at end of file
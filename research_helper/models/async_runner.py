@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import traceback
+from concurrent.futures import Future
+from typing import Any, Dict, Optional
+
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.config import RunnableConfig
+
+class Job:
+    """
+        a model run submitted to AsyncRunner
+
+        it takes the place of the view for UICallbackHandler: callbacks on the loop thread write into it
+        and the script thread polls it with snapshot(), streamlit elements cannot be drawn from the loop thread
+    """
+
+    def __init__(self, input: Any) -> None:
+        self.input = input
+        self._lock = threading.Lock()
+        self._outputs: Dict[str, Any] = {}
+        self._error: Optional[str] = None
+        self._future: Optional[Future] = None
+
+    def write(self, outputs: Dict) -> None:
+        with self._lock:
+            self._outputs.update(outputs)
+
+    def error(self, error: str) -> None:
+        with self._lock:
+            self._error = error
+
+    def update(self) -> None:
+        """ nothing to redraw, the view polls the job """
+
+    def bind(self, future: Future) -> "Job":
+        """ the job is done when the future is """
+        self._future = future
+        return self
+
+    @property
+    def done(self) -> bool:
+        return self._future is not None and self._future.done()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """ copy of the outputs streamed so far and the error if any """
+        with self._lock:
+            return {"outputs": dict(self._outputs), "error": self._error}
+
+def _add_chunk(output: Any, chunk: Any) -> Any:
+    if output is None:
+        return chunk
+    try:
+        return output+chunk # str, AddableDict and message chunks
+    except TypeError:
+        return chunk
+
+class AsyncRunner:
+    """
+        one event loop on a daemon thread, shared by every task and session of the server process.
+        models run with astream, so I/O-bound models overlap and sync ones run on the loop's executor
+    """
+
+    def __init__(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="async-runner", daemon=True)
+        self._thread.start()
+
+    def submit(self, job: Job, model: Runnable, config: Optional[RunnableConfig] = None) -> Job:
+        """ start the job on the loop and return it at once """
+        return job.bind(asyncio.run_coroutine_threadsafe(self._run(job, model, config), self._loop))
+
+    async def _run(self, job: Job, model: Runnable, config: Optional[RunnableConfig]) -> None:
+        output = None
+        try:
+            async for chunk in model.astream(job.input, config):
+                output = _add_chunk(output, chunk)
+                job.write(output if isinstance(output, dict) else {"output": output})
+        except Exception:
+            job.error(traceback.format_exc())
+
+_runner: Optional[AsyncRunner] = None
+_runner_lock = threading.Lock()
+
+def get_runner() -> AsyncRunner:
+    """ the runner of this process, started on first use """
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = AsyncRunner()
+        return _runner
@@ -2,7 +2,7 @@ from abc import ABC, abstractmethod
 from typing import Optional
 
 from langchain_core.runnables.base import Input, Output, Runnable
-from langchain_core.runnables.config import RunnableConfig
+from langchain_core.runnables.config import RunnableConfig, run_in_executor
 
 class Model(Runnable):
     """
@@ -18,3 +18,31 @@ class Model(Runnable):
     @abstractmethod
     def _invoke(self, input: Input, config:Optional[RunnableConfig]=None) -> Output:
         pass
+
+class ModelWrapper(Model):
+    """
+        adds behaviour around a model without a run of its own,
+        so traces keep the run tree of the wrapped model and the columns flattened from it
+    """
+    
+    def __init__(self, model: Runnable) -> None:
+        self._model = model
+        self.name = model.get_name() # traces keep the name of the model
+    
+    @property
+    def wrapped(self) -> Runnable:
+        """ the innermost model """
+        model = self._model
+        while isinstance(model, ModelWrapper):
+            model = model._model
+        return model
+    
+    def invoke(self, input: Input, config: Optional[RunnableConfig]=None) -> Output:
+        return self._invoke(input, config)
+    
+    async def ainvoke(self, input: Input, config: Optional[RunnableConfig]=None, **kwargs) -> Output:
+        return await self._ainvoke(input, config)
+    
+    async def _ainvoke(self, input: Input, config: Optional[RunnableConfig]=None) -> Output:
+        """ _invoke on the executor of the loop, wrappers which wait override it so that the wait holds no thread """
+        return await run_in_executor(config, self._invoke, input, config)
@@ -0,0 +1,61 @@
+import time
+from dataclasses import dataclass, field
+from typing import Any, Iterator, List, Optional, Tuple
+
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.config import RunnableConfig
+
+@dataclass
+class BatchProgress:
+    total: int
+    done: int = 0
+    errors: int = 0
+    started: float = field(default_factory=time.perf_counter)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter()-self.started
+
+    @property
+    def throughput(self) -> float:
+        """ finished inputs per second """
+        elapsed = self.elapsed
+        return self.done/elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """ seconds until every input is finished at the current throughput """
+        throughput = self.throughput
+        return (self.total-self.done)/throughput if throughput > 0 else None
+
+@dataclass
+class BatchResult:
+    index: int # position of the input in the batch
+    input: Any
+    output: Any = None
+    error: Optional[Exception] = None
+
+def batch_as_completed(
+    model: Runnable,
+    inputs: List[Any],
+    config: Optional[RunnableConfig] = None,
+    max_concurrency: int = 8,
+) -> Iterator[Tuple[BatchResult, BatchProgress]]:
+    """
+    run the inputs through model.batch_as_completed and yield each result as soon as it finishes.
+    the model runs on worker threads, results are yielded on the calling thread,
+    so streamlit elements can be written from the loop but not from the callbacks in `config`.
+
+    Args:
+        max_concurrency (int): number of inputs run at once
+    """
+    progress = BatchProgress(total=len(inputs))
+    config = {**(config or {}), "max_concurrency": max_concurrency}
+    for idx, output in model.batch_as_completed(inputs, config, return_exceptions=True):
+        progress.done += 1
+        if isinstance(output, Exception):
+            progress.errors += 1
+            result = BatchResult(index=idx, input=inputs[idx], error=output)
+        else:
+            result = BatchResult(index=idx, input=inputs[idx], output=output)
+        yield result, progress
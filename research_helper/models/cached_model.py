@@ -0,0 +1,70 @@
+from typing import Optional
+
+from langchain_core.globals import get_llm_cache, set_llm_cache
+from langchain_core.runnables.base import Input, Output, Runnable
+from langchain_core.runnables.config import RunnableConfig
+
+from research_helper.models.base import ModelWrapper
+from research_helper.models.response_cache import (
+    ResponseCache, ResponseLLMCache, ScopedLLMCache, CacheMissError,
+    cache_key, model_fingerprint, dumps_response, loads_response, current_llm_cache,
+)
+
+CACHE_MODES = ["off", "record", "replay"]
+
+class CachedModel(ModelWrapper):
+    """
+        returns the recorded output when a model is invoked again with the same input and config
+
+        the key is cache_key(input, model_fingerprint(model)) of the innermost model, so uploading a changed model misses the cache.
+        a hit is traced as a run of the model without children
+    """
+
+    def __init__(self, model: Runnable, cache: ResponseCache, replay: bool = False, cache_llm_calls: bool = True) -> None:
+        """
+        Args:
+            replay (bool): never record and never call the model, a miss raises CacheMissError
+            cache_llm_calls (bool): also cache each LLM call made inside the model,
+                so changing one prompt of a chain only pays for the calls which changed.
+                not used when another global langchain cache is set
+        """
+        super().__init__(model)
+        self._cache = cache
+        self._replay = replay
+        self._llm_cache = ResponseLLMCache(cache, replay=replay) if cache_llm_calls else None
+        self._fingerprint = model_fingerprint(self.wrapped)
+
+        if self._llm_cache and get_llm_cache() is None:
+            set_llm_cache(ScopedLLMCache())
+
+    def _invoke(self, input: Input, config: Optional[RunnableConfig] = None) -> Output:
+        key = cache_key(input, self._fingerprint)
+        if (value := self._cache.get(key)) is not None:
+            return self._call_with_config(lambda input: loads_response(value), input, config)
+        if self._replay:
+            raise CacheMissError(f"no recorded response for the input {str(input)[:200]!r}")
+
+        token = current_llm_cache.set(self._llm_cache)
+        try:
+            output = self._model.invoke(input, config)
+        finally:
+            current_llm_cache.reset(token)
+
+        if not self._replay:
+            self._cache.put(key, dumps_response(output))
+        return output
+
+    async def _ainvoke(self, input: Input, config: Optional[RunnableConfig] = None) -> Output:
+        key = cache_key(input, self._fingerprint)
+        if self._replay or self._cache.get(key) is not None:
+            # a hit or a miss in replay does not call the model
+            return await super()._ainvoke(input, config)
+
+        token = current_llm_cache.set(self._llm_cache)
+        try:
+            output = await self._model.ainvoke(input, config)
+        finally:
+            current_llm_cache.reset(token)
+
+        self._cache.put(key, dumps_response(output))
+        return output
@@ -0,0 +1,51 @@
+import os
+import inspect
+import importlib
+from typing import Tuple
+
+from langchain_core.runnables import Runnable
+
+class ModelNotFoundError(Exception):
+    pass
+
+def path2module_name(path: str):
+    if path.startswith(("/", "./")):
+        path = path.split("/", maxsplit=1)[-1] # remove "./" or "/" e.x.) ./a/b/c.py -> a/b/c.py
+    module_name, ext = os.path.splitext(path)  # e.x.) a/b/c.py -> a/b/c
+    module_name = module_name.replace("/", ".")       # e.x.) a/b/c -> a.b.c
+    return module_name
+
+def load_model_cls(model_path: str) -> Tuple[type, Runnable]:
+    """ import user_model.py and return the class of its model and an instance """
+    # prepare module path
+    module_name = path2module_name(model_path)
+    
+    # import
+    module = importlib.import_module(module_name)
+    module = importlib.reload(module)
+    user_runnables = [
+        {
+            "cls"    : cls_info[1],
+            "parents": cls_info[1].__mro__
+        }
+        for cls_info in inspect.getmembers(module, inspect.isclass)
+        if issubclass(cls_info[1], Runnable)
+    ]
+    
+    if user_runnables:
+        # 継承が深い順にソート
+        sorted_runnables = sorted(user_runnables, key=lambda cls_info: len(cls_info["parents"]), reverse=True)
+        
+        for user_runnable in user_runnables:
+            model_cls: Runnable = user_runnable["cls"]
+            if model_cls.name == "entry_point":
+                # もし "entry_point" という名前の ruunable があれば、それを model とする。
+                return model_cls, model_cls()
+        
+        # otherwise
+        # ユーザが定義した runnable のうち継承が最も深いものを model とする。
+        # 例えば research_helper.models.Model を 継承した SubModel があった場合 SubModel が対象となる
+        model_cls = sorted_runnables[0]["cls"]
+        return model_cls, model_cls()
+    
+    raise ModelNotFoundError("You need to define your model extending langchain_core.runnables.Runnable")
@@ -0,0 +1,191 @@
+import os
+import traceback
+import threading
+import multiprocessing
+from dataclasses import dataclass, field
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from langchain_core.runnables import Runnable
+from langchain_core.tracers.schemas import Run
+
+from research_helper.schemas.run import RunSerializable
+from research_helper.tracer.trace_log import TraceLogBase
+from research_helper.tracer.run_codec import RunCodec
+from research_helper.tracer.trace_collector import TraceCollectorCallbackHandler
+from research_helper.models.loader import load_model_cls
+from research_helper.models.batch import BatchProgress, BatchResult
+from research_helper.models.async_runner import Job
+from research_helper.models.cached_model import CachedModel
+from research_helper.models.response_cache import ResponseCache, dumps_response, loads_response
+
+@dataclass
+class WorkerResult:
+    """ what a worker ships back, everything is serialized so that it pickles cheaply """
+    output: Optional[bytes] = None
+    error: Optional[str] = None
+    traces: List[str] = field(default_factory=list) # RunCodec lines
+
+class _TraceBuffer(TraceLogBase):
+    """ keeps the traces of one invoke in the worker """
+
+    def __init__(self) -> None:
+        self.traces: List[RunSerializable] = []
+
+    def add_trace(self, run: Run) -> Union[RunSerializable, None]:
+        if run.parent_run_id is not None:
+            return None
+        added_run = run if isinstance(run, RunSerializable) else RunSerializable.from_run(run)
+        self.traces.append(added_run)
+        return added_run
+
+    def get_trace(self, offset: int = 0, limit: Optional[int] = None) -> List[RunSerializable]:
+        return self.traces[offset:] if limit is None else self.traces[offset:offset+limit]
+
+    def save(self) -> None:
+        """ the traces are shipped to the parent """
+
+    @property
+    def _serialized(self) -> str:
+        return "".join(RunCodec().dumps(run) for run in self.traces)
+
+# state of a worker process, set once by _init_worker
+_model: Optional[Runnable] = None
+_collector_kwargs: Dict[str, Any] = {}
+
+def _init_worker(model_path: str, cache_path: Optional[str], replay: bool, collector_kwargs: Dict[str, Any]) -> None:
+    global _model, _collector_kwargs
+    _, _model = load_model_cls(model_path)
+    _collector_kwargs = collector_kwargs
+    if cache_path:
+        _model = CachedModel(_model, ResponseCache(cache_path), replay=replay)
+
+def _run(input: Any) -> WorkerResult:
+    buffer = _TraceBuffer()
+    result = WorkerResult()
+    try:
+        output = _model.invoke(input, config={"callbacks": [TraceCollectorCallbackHandler(log=buffer, **_collector_kwargs)]})
+        result.output = dumps_response(output)
+    except Exception:
+        result.error = traceback.format_exc()
+    codec = RunCodec()
+    result.traces = [codec.dumps(trace) for trace in buffer.traces]
+    return result
+
+class ProcessModelPool:
+    """
+        runs the model of a user_model.py in worker processes, one instance per worker loaded once,
+        so CPU-bound models use every core and a model which crashes its process does not take down the UI.
+
+        a crashed worker breaks the whole executor and fails every input pending on it,
+        those inputs are run again on new workers up to `max_retries` times. the input which crashed
+        cannot be told apart, so an input which always crashes its worker fails the others pending with it at the end
+
+        outputs and run trees come back serialized, the run trees are added to `log` by the parent
+    """
+
+    def __init__(
+        self, model_path: str, log: TraceLogBase, workers: Optional[int] = None,
+        cache_path: Optional[str] = None, replay: bool = False, max_retries: int = 2,
+        collector_kwargs: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Args:
+            workers (int): number of worker processes, os.cpu_count() by default
+            cache_path (str): ResponseCache file the workers share, no cache if None
+            replay (bool): see CachedModel
+            max_retries (int): times an input is run again after the workers crashed under it
+            collector_kwargs (Optional[Dict[str, Any]]): sampling arguments of the TraceCollectorCallbackHandler of the workers
+        """
+        self._initargs = (model_path, cache_path, replay, collector_kwargs or {})
+        self._log = log
+        self._workers = workers or os.cpu_count()
+        self._max_retries = max_retries
+        self._codec = RunCodec()
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # spawn, forking a server with running threads is not safe
+        return ProcessPoolExecutor(
+            max_workers=self._workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=self._initargs,
+        )
+
+    def _submit(self, input: Any) -> Future:
+        """ future of the WorkerResult of the input, which outlives a restart of the workers """
+        result = Future()
+        self._start(input, result, attempt=0)
+        return result
+
+    def _start(self, input: Any, result: Future, attempt: int) -> None:
+        with self._lock:
+            try:
+                future = self._executor.submit(_run, input)
+            except BrokenProcessPool:
+                # a worker died, start over with new workers
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+                future = self._executor.submit(_run, input)
+        future.add_done_callback(lambda future: self._on_done(future, input, result, attempt))
+
+    def _on_done(self, future: Future, input: Any, result: Future, attempt: int) -> None:
+        try:
+            result.set_result(future.result())
+        except BrokenProcessPool as e:
+            if attempt < self._max_retries:
+                self._start(input, result, attempt+1)
+            else:
+                result.set_exception(e)
+        except Exception as e:
+            result.set_exception(e)
+
+    def _finish(self, future: Future) -> Tuple[Any, Optional[str]]:
+        """ log the traces of a finished input and return its (output, error) """
+        try:
+            result: WorkerResult = future.result()
+        except Exception as e:
+            return None, f"worker failed: {e!r}"
+        for line in result.traces:
+            self._log.add_trace(self._codec.loads(line))
+        if result.error is not None:
+            return None, result.error
+        return loads_response(result.output), None
+
+    def submit(self, job: Job) -> Job:
+        """ run the input of the job and return the job at once, it is done once its traces are logged """
+        done = Future()
+
+        def on_done(future: Future) -> None:
+            output, error = self._finish(future)
+            if error is not None:
+                job.error(error)
+            else:
+                job.write(output if isinstance(output, dict) else {"output": output})
+            done.set_result(None)
+
+        job.bind(done)
+        self._submit(job.input).add_done_callback(on_done)
+        return job
+
+    def as_completed(self, inputs: List[Any]) -> Iterator[Tuple[BatchResult, BatchProgress]]:
+        """ like batch.batch_as_completed, with the workers as the concurrency """
+        progress = BatchProgress(total=len(inputs))
+        futures = {self._submit(input): idx for idx, input in enumerate(inputs)}
+        for future in as_completed(futures):
+            idx = futures[future]
+            output, error = self._finish(future)
+            progress.done += 1
+            if error is not None:
+                progress.errors += 1
+                result = BatchResult(index=idx, input=inputs[idx], error=RuntimeError(error))
+            else:
+                result = BatchResult(index=idx, input=inputs[idx], output=output)
+            yield result, progress
+
+    def close(self) -> None:
+        with self._lock:
+            self._executor.shutdown(wait=False, cancel_futures=True)
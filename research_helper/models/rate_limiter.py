@@ -0,0 +1,349 @@
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, Optional, Tuple, Union
+
+from langchain_core.callbacks import BaseCallbackHandler, BaseCallbackManager
+from langchain_core.outputs import LLMResult
+from langchain_core.runnables.base import Input, Output, Runnable
+from langchain_core.runnables.config import RunnableConfig
+
+from research_helper.models.base import ModelWrapper
+from research_helper.tracer.histogram import Histogram
+
+RATE_WINDOW = 60.0 # seconds over which the achieved rates are measured
+DECREASE_INTERVAL = 1.0 # throttled calls within this many seconds of a decrease are one congestion event
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """ throttling reported by the backend, e.g. openai.RateLimitError or an http 429 """
+    if "RateLimit" in type(error).__name__:
+        return True
+    status_code = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status_code == 429
+
+class TokenBucket:
+    """
+        `rate` units per second with bursts of up to `capacity`
+
+        the balance may go negative, so that usage which is only known after a call
+        (tokens of a response) delays the following calls instead of being dropped
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        """
+        Args:
+            capacity (Optional[float]): one second of the current rate if None
+        """
+        self.rate = rate
+        self._capacity = capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self) -> float:
+        return self._capacity if self._capacity is not None else max(self.rate, 1.0)
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self._tokens+(now-self._updated)*self.rate, self.capacity)
+        self._updated = now
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """ take `amount` and return the seconds to wait before using it """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            return max(-self._tokens, 0.0)/self.rate
+
+    def consume(self, amount: float) -> None:
+        """ take `amount` without waiting, e.g. tokens counted after a call """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+
+class Slots:
+    """
+        semaphore shared by threads and event loops, a coroutine waits for a slot without holding a thread
+
+        slots are handed to waiters in the order they came, whether threads or coroutines
+    """
+
+    def __init__(self, size: int) -> None:
+        self._free = size
+        self._lock = threading.Lock()
+        self._waiters: Deque[Union[threading.Event, asyncio.Future]] = deque()
+
+    def acquire(self) -> None:
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                return
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+        waiter.wait()
+
+    async def aacquire(self) -> None:
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                return
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            if waiter.done() and not waiter.cancelled():
+                self.release() # handed over just before the cancel
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            if not self._waiters:
+                self._free += 1
+                return
+            waiter = self._waiters.popleft()
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+        else:
+            waiter.get_loop().call_soon_threadsafe(self._hand_over, waiter)
+
+    def _hand_over(self, waiter: asyncio.Future) -> None:
+        if waiter.cancelled():
+            self.release() # the waiter gave up meanwhile, the slot goes to the next one
+        else:
+            waiter.set_result(None)
+
+@dataclass
+class RateLimiterStats:
+    calls: int = 0
+    errors: int = 0
+    throttled: int = 0            # calls which failed with is_rate_limit_error
+    retries: int = 0
+    in_flight: int = 0
+    max_in_flight: int = 0
+    tokens: int = 0
+    queue_wait: Histogram = field(default_factory=Histogram) # microseconds from the call until it was let through
+
+class RateLimiter:
+    """
+        paces calls with token buckets on requests per second and tokens per minute and caps the calls in flight.
+
+        the request rate adapts: it is cut by `decrease` when the backend throttles and grows back
+        by `increase` of max_rps per second of successful calls (AIMD), so it settles just under what the backend sustains.
+    """
+
+    def __init__(
+        self, max_rps: Optional[float] = None, max_tpm: Optional[float] = None, max_in_flight: Optional[int] = None,
+        min_rps: float = 0.1, decrease: float = 0.5, increase: float = 0.05,
+    ) -> None:
+        """
+        Args:
+            max_rps (Optional[float]): requests per second, unlimited if None
+            max_tpm (Optional[float]): tokens per minute as reported by the LLM runs, unlimited if None
+            max_in_flight (Optional[int]): calls running at once, unlimited if None
+            min_rps (float): the adaptive rate never goes below this
+            decrease (float): factor applied to the rate when throttled
+            increase (float): fraction of max_rps added to the rate per second of successful calls
+        """
+        self._max_rps = max_rps
+        self._min_rps = min(min_rps, max_rps) if max_rps else min_rps
+        self._decrease = decrease
+        self._increase = increase
+        self._requests = TokenBucket(max_rps) if max_rps else None
+        self._tokens = TokenBucket(max_tpm/60, capacity=max_tpm) if max_tpm else None
+        self._slots = Slots(max_in_flight) if max_in_flight else None
+
+        self._lock = threading.Lock()
+        self._stats = RateLimiterStats()
+        self._last_decrease = 0.0
+        self._finished: Deque[Tuple[float, int]] = deque() # (time, tokens) of calls in the last RATE_WINDOW
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """ wait for a turn, the body is the call """
+        start = time.monotonic()
+        if self._slots:
+            self._slots.acquire()
+        try:
+            if (wait := self._reserve()) > 0:
+                time.sleep(wait)
+            self._enter(start)
+            try:
+                yield
+            finally:
+                self._exit()
+        finally:
+            if self._slots:
+                self._slots.release()
+
+    @asynccontextmanager
+    async def aslot(self) -> AsyncIterator[None]:
+        """ slot for a coroutine, it waits on the event loop instead of blocking a thread of the executor """
+        start = time.monotonic()
+        if self._slots:
+            await self._slots.aacquire()
+        try:
+            if (wait := self._reserve()) > 0:
+                await asyncio.sleep(wait)
+            self._enter(start)
+            try:
+                yield
+            finally:
+                self._exit()
+        finally:
+            if self._slots:
+                self._slots.release()
+
+    def _reserve(self) -> float:
+        """ seconds to wait for the buckets """
+        return max(
+            self._requests.reserve() if self._requests else 0.0,
+            self._tokens.reserve(0) if self._tokens else 0.0, # only waits while the budget is in debt
+        )
+
+    def _enter(self, start: float) -> None:
+        with self._lock:
+            self._stats.queue_wait.record((time.monotonic()-start)*1e6)
+            self._stats.in_flight += 1
+            self._stats.max_in_flight = max(self._stats.max_in_flight, self._stats.in_flight)
+
+    def _exit(self) -> None:
+        with self._lock:
+            self._stats.in_flight -= 1
+
+    def on_success(self, tokens: int = 0) -> None:
+        if self._tokens and tokens:
+            self._tokens.consume(tokens)
+        with self._lock:
+            self._stats.calls += 1
+            self._stats.tokens += tokens
+            self._record(tokens)
+            if self._requests:
+                # a call takes 1/rate of a second at the current rate
+                rate = self._requests.rate
+                self._requests.rate = min(rate+self._increase*self._max_rps/rate, self._max_rps)
+
+    def on_error(self, error: BaseException) -> None:
+        with self._lock:
+            self._stats.calls += 1
+            self._stats.errors += 1
+            self._record(0)
+            if is_rate_limit_error(error):
+                self._stats.throttled += 1
+                now = time.monotonic()
+                if self._requests and now-self._last_decrease >= DECREASE_INTERVAL:
+                    self._requests.rate = max(self._requests.rate*self._decrease, self._min_rps)
+                    self._last_decrease = now
+
+    def backoff(self, attempt: int) -> float:
+        """ seconds to wait before retrying a throttled call, the retry is paced by the buckets on top """
+        with self._lock:
+            self._stats.retries += 1
+        return min(0.5*2**(attempt-1), 30.0)*random.uniform(0.5, 1.0)
+
+    def _record(self, tokens: int) -> None:
+        now = time.monotonic()
+        self._finished.append((now, tokens))
+        self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        while self._finished and self._finished[0][0] < now-RATE_WINDOW:
+            self._finished.popleft()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            window = min(RATE_WINDOW, now-self._finished[0][0]) if self._finished else 0.0
+            return {
+                "calls": self._stats.calls,
+                "errors": self._stats.errors,
+                "throttled": self._stats.throttled,
+                "retries": self._stats.retries,
+                "in_flight": self._stats.in_flight,
+                "max_in_flight": self._stats.max_in_flight,
+                "tokens": self._stats.tokens,
+                "current_rps_limit": self._requests.rate if self._requests else None,
+                "achieved_rps": len(self._finished)/window if window > 0 else 0.0,
+                "achieved_tpm": sum(tokens for _, tokens in self._finished)/window*60 if window > 0 else 0.0,
+                "queue_wait_us": self._stats.queue_wait.snapshot(),
+            }
+
+class _UsageCounter(BaseCallbackHandler):
+    """ sums the tokens reported by the LLM calls of one call """
+
+    def __init__(self) -> None:
+        self.tokens = 0
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if isinstance(usage.get("total_tokens"), int):
+            self.tokens += usage["total_tokens"]
+            return
+        for generations in response.generations:
+            for generation in generations:
+                metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                self.tokens += metadata.get("total_tokens", 0)
+
+class RateLimitedModel(ModelWrapper):
+    """ calls the model through a RateLimiter, throttled calls are retried after a backoff """
+
+    def __init__(self, model: Runnable, limiter: RateLimiter, max_retries: int = 3) -> None:
+        super().__init__(model)
+        self._limiter = limiter
+        self._max_retries = max_retries
+
+    def _invoke(self, input: Input, config: Optional[RunnableConfig] = None) -> Output:
+        attempt = 0
+        while True:
+            counter = _UsageCounter()
+            with self._limiter.slot():
+                try:
+                    output = self._model.invoke(input, _with_handler(config, counter))
+                except Exception as e:
+                    self._limiter.on_error(e)
+                    if not is_rate_limit_error(e) or attempt >= self._max_retries:
+                        raise
+                else:
+                    self._limiter.on_success(counter.tokens)
+                    return output
+            # wait outside the slot, so other calls are not held up by the backoff
+            attempt += 1
+            time.sleep(self._limiter.backoff(attempt))
+
+    async def _ainvoke(self, input: Input, config: Optional[RunnableConfig] = None) -> Output:
+        # same as _invoke, waiting on the loop so that queued calls do not take up the threads of its executor
+        attempt = 0
+        while True:
+            counter = _UsageCounter()
+            async with self._limiter.aslot():
+                try:
+                    output = await self._model.ainvoke(input, _with_handler(config, counter))
+                except Exception as e:
+                    self._limiter.on_error(e)
+                    if not is_rate_limit_error(e) or attempt >= self._max_retries:
+                        raise
+                else:
+                    self._limiter.on_success(counter.tokens)
+                    return output
+            attempt += 1
+            await asyncio.sleep(self._limiter.backoff(attempt))
+
+def _with_handler(config: Optional[RunnableConfig], handler: BaseCallbackHandler) -> RunnableConfig:
+    config = dict(config or {})
+    callbacks = config.get("callbacks")
+    if isinstance(callbacks, BaseCallbackManager):
+        callbacks = callbacks.copy()
+        callbacks.add_handler(handler, inherit=True)
+    else:
+        callbacks = [*(callbacks or []), handler]
+    config["callbacks"] = callbacks
+    return config
@@ -0,0 +1,195 @@
+import time
+import sqlite3
+import inspect
+import threading
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import orjson
+import xxhash
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.load import Serializable, dumpd, load
+from langchain_core.runnables import Runnable
+
+from research_helper.schemas.run import dump_serializable, try_load
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key         TEXT PRIMARY KEY,
+    value       BLOB NOT NULL,
+    size        INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_access_idx ON responses(last_access);
+"""
+ACCESS_BATCH = 256 # hits whose access time is written at once
+
+class CacheMissError(Exception):
+    pass
+
+def cache_key(*parts: Any) -> str:
+    """ stable hash of the serialized parts, dict keys are sorted so their order does not matter """
+    data = orjson.dumps(dump_serializable(list(parts)), option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    return xxhash.xxh3_128_hexdigest(data)
+
+def model_fingerprint(model: Runnable) -> Any:
+    """
+    what decides the output of a model besides its input: the source file of its class and its serialized config.
+    the whole file is hashed, so editing a helper, a constant or a prompt of user_model.py misses the cache
+    """
+    cls = type(model)
+    try:
+        with open(inspect.getsourcefile(cls), mode="rb") as source_file:
+            source = xxhash.xxh3_128_hexdigest(source_file.read())
+    except (OSError, TypeError):
+        source = None
+    return {
+        "class": f"{cls.__module__}.{cls.__qualname__}",
+        "source": source,
+        "config": dumpd(model) if isinstance(model, Serializable) and model.is_lc_serializable() else None,
+    }
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits+self.misses
+        return self.hits/lookups if lookups else 0.0
+
+class ResponseCache:
+    """
+        responses of models stored in sqlite by cache_key
+
+        once the stored responses exceed max_bytes, the least recently used ones are evicted
+    """
+
+    def __init__(self, file_path: str, max_bytes: int = 256 << 20) -> None:
+        self._file_path = file_path
+        self._max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._stats = CacheStats()
+        self._accessed: Dict[str, float] = {} # access times of hits which are not written yet
+        # streamlit reruns a script on different threads
+        self._connection = sqlite3.connect(file_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        self._connection.commit()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._stats.misses += 1
+                return None
+            # a hit does not take the write lock of the file, access times are written in batches
+            self._accessed[key] = time.time()
+            if len(self._accessed) >= ACCESS_BATCH:
+                self._write_access()
+                self._connection.commit()
+            self._stats.hits += 1
+            return row[0]
+
+    def _write_access(self) -> None:
+        self._connection.executemany(
+            "UPDATE responses SET last_access = MAX(last_access, ?) WHERE key = ?",
+            [(accessed, key) for key, accessed in self._accessed.items()],
+        )
+        self._accessed = {}
+
+    def put(self, key: str, value: bytes) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()),
+            )
+            self._write_access() # eviction goes by the latest access times
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self) -> None:
+        # the total is read back every time, other processes may share the file
+        total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self._max_bytes: return
+
+        evicted, freed = [], 0
+        for key, size in self._connection.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            if total-freed <= self._max_bytes:
+                break
+            evicted.append((key,))
+            freed += size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self._stats.evictions += len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @property
+    def stats(self) -> CacheStats:
+        return self._stats
+
+    def close(self) -> None:
+        with self._lock:
+            self._write_access()
+            self._connection.commit()
+            self._connection.close()
+
+class ResponseLLMCache(BaseCache):
+    """ langchain cache hook over a ResponseCache, install it with langchain_core.globals.set_llm_cache or as `cache` of a model """
+
+    def __init__(self, cache: ResponseCache, replay: bool = False) -> None:
+        """
+        Args:
+            replay (bool): raise CacheMissError instead of calling the model on a miss
+        """
+        self._cache = cache
+        self._replay = replay
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        value = self._cache.get(cache_key("llm", prompt, llm_string))
+        if value is None:
+            if self._replay:
+                raise CacheMissError(f"no recorded response for the prompt {prompt[:200]!r}")
+            return None
+        return [load(generation) for generation in orjson.loads(value)]
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        if self._replay: return
+        self._cache.put(cache_key("llm", prompt, llm_string), orjson.dumps([dumpd(generation) for generation in return_val]))
+
+    def clear(self, **kwargs: Any) -> None:
+        self._cache.clear()
+
+# the hook of the CachedModel being invoked, contexts are copied into the threads langchain runs nodes on
+current_llm_cache: ContextVar[Optional[ResponseLLMCache]] = ContextVar("current_llm_cache", default=None)
+
+class ScopedLLMCache(BaseCache):
+    """ global langchain cache which forwards LLM calls made inside CachedModel to its ResponseLLMCache, others are not cached """
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        llm_cache = current_llm_cache.get()
+        return llm_cache.lookup(prompt, llm_string) if llm_cache else None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        llm_cache = current_llm_cache.get()
+        if llm_cache:
+            llm_cache.update(prompt, llm_string, return_val)
+
+    def clear(self, **kwargs: Any) -> None:
+        """ the scoped caches are cleared through their ResponseCache """
+
+def dumps_response(output: Any) -> bytes:
+    return orjson.dumps(dump_serializable(output), option=orjson.OPT_NON_STR_KEYS)
+
+def loads_response(value: bytes) -> Any:
+    return try_load(orjson.loads(value))
@@ -1,23 +1,75 @@
-from typing import Any, Optional, Dict, List, TypeVar
+from typing import Any, Callable, Optional, Dict, List, TypeVar
 from typing_extensions import Annotated
 from pydantic import BaseModel, Field, PlainValidator, PlainSerializer
 from datetime import datetime
 from uuid import UUID
+import orjson
 from langchain_core.tracers.schemas import Run
-from langchain_core.load import Serializable, load, dumpd
+from langchain_core.load import Serializable, load
+from langchain_core.load.serializable import to_json_not_implemented
 
 Self = TypeVar("Self", bound="RunSerializable")
 
+def is_lc_serialized(obj: Any) -> bool:
+    """ whether obj holds a dict dumped by langchain's dumpd, only those need load """
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            if "lc" in item and "type" in item:
+                return True
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+    return False
+
 def try_load(obj):
+    if not is_lc_serialized(obj):
+        return obj
+    return _load(obj)
+
+def _load(obj):
     try:
         return load(obj)
     except:
         return obj
 
+JSON_KEYS = {True: "true", False: "false", None: "null"}
+
+def _to_json(obj: Any) -> Any:
+    if obj is None or isinstance(obj, (str, int, float)):
+        return obj
+    if isinstance(obj, dict):
+        return {_to_json_key(key): _to_json(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_to_json(value) for value in obj]
+    if isinstance(obj, Serializable):
+        return _to_json(obj.to_json())
+    return to_json_not_implemented(obj)
+
+def _to_json_key(key: Any) -> str:
+    if isinstance(key, str):
+        return key
+    if key is None or isinstance(key, bool):
+        return JSON_KEYS[key]
+    if isinstance(key, (int, float)):
+        return str(int(key)) if isinstance(key, int) else repr(key)
+    raise TypeError(f"keys must be str, int, float, bool or None, not {type(key).__name__}")
+
+def dump_serializable(obj: Any) -> Any:
+    """ same as langchain's dumpd without its json.dumps -> json.loads round trip """
+    try:
+        return _to_json(obj)
+    except TypeError:
+        return to_json_not_implemented(obj)
+
+def _optional(convert: Callable[[Any], Any], value: Any) -> Any:
+    return None if value is None else convert(value)
+
 serializable = Annotated[
     Serializable,
     PlainValidator(try_load),
-    PlainSerializer(dumpd)
+    PlainSerializer(dump_serializable)
 ]
 
 class RunSerializable(BaseModel):
@@ -41,25 +93,71 @@ class RunSerializable(BaseModel):
     
     @classmethod
     def from_run(cls: Self, run: Run) -> Self:
-        return cls(
-            id=run.id,
-            name=run.name,
-            start_time=run.start_time,
-            run_type=run.run_type,
-            end_time=run.end_time,
-            extra=run.extra,
-            error=run.error,
-            serialized=run.serialized,
-            events=run.events,
-            inputs=run.inputs,
-            outputs=run.outputs,
-            reference_example_id=run.reference_example_id,
-            parent_run_id=run.parent_run_id,
-            child_runs=[
-                RunSerializable.from_run(run=child_run)
-                for child_run in run.child_runs
-            ],
-            tags=run.tags,
-            trace_id=run.trace_id,
-            dotted_order=run.dotted_order,
-        )
+        """ the fields of a Run are already typed, so they are not validated again """
+        return cls._construct_tree(run, lambda node: node.child_runs, lambda node: dict(
+            id=node.id,
+            name=node.name,
+            start_time=node.start_time,
+            run_type=node.run_type,
+            end_time=node.end_time,
+            extra=node.extra,
+            error=node.error,
+            serialized=node.serialized,
+            events=list(node.events),
+            inputs={key: try_load(value) for key, value in node.inputs.items()},
+            outputs={key: try_load(value) for key, value in node.outputs.items()} if node.outputs is not None else None,
+            reference_example_id=node.reference_example_id,
+            parent_run_id=node.parent_run_id,
+            tags=list(node.tags) if node.tags is not None else None,
+            trace_id=node.trace_id,
+            dotted_order=node.dotted_order,
+        ))
+    
+    @classmethod
+    def from_trusted_json(cls: Self, data: Dict[str, Any]) -> Self:
+        """
+            the json of a run dumped by this model, only ids and times are converted back instead of validating every field.
+            a payload repeated across the nodes of the trace, like the prompt of each branch, is loaded once
+        """
+        loaded: Dict[bytes, Any] = {}
+        def try_load(value: Any) -> Any:
+            if not is_lc_serialized(value):
+                return value
+            key = orjson.dumps(value)
+            if key not in loaded:
+                loaded[key] = _load(value)
+            return loaded[key]
+        
+        return cls._construct_tree(data, lambda node: node.get("child_runs") or [], lambda node: dict(
+            id=UUID(node["id"]),
+            name=node["name"],
+            start_time=datetime.fromisoformat(node["start_time"]),
+            run_type=node["run_type"],
+            end_time=_optional(datetime.fromisoformat, node.get("end_time")),
+            extra=node.get("extra"),
+            error=node.get("error"),
+            serialized=node.get("serialized"),
+            events=node.get("events", []),
+            inputs={key: try_load(value) for key, value in node.get("inputs", {}).items()},
+            outputs={key: try_load(value) for key, value in node["outputs"].items()} if node.get("outputs") is not None else None,
+            reference_example_id=_optional(UUID, node.get("reference_example_id")),
+            parent_run_id=_optional(UUID, node.get("parent_run_id")),
+            tags=node.get("tags", []),
+            trace_id=_optional(UUID, node.get("trace_id")),
+            dotted_order=node.get("dotted_order"),
+        ))
+    
+    @classmethod
+    def _construct_tree(cls: Self, run: Any, children: Callable[[Any], List[Any]], fields: Callable[[Any], Dict[str, Any]]) -> Self:
+        root = None
+        stack = [(run, None)]
+        while stack:
+            node, parent = stack.pop()
+            converted = cls.model_construct(**fields(node), child_runs=[])
+            if parent is None:
+                root = converted
+            else:
+                parent.child_runs.append(converted)
+            # reversed so that children are appended in order
+            stack.extend((child_run, converted) for child_run in reversed(children(node)))
+        return root
@@ -0,0 +1,169 @@
+import os
+import mmap
+import struct
+import threading
+from datetime import datetime
+from typing import Union, Dict, List, Optional
+
+import numpy as np
+import orjson
+from langchain_core.tracers.schemas import Run
+
+from research_helper.schemas.run import RunSerializable
+from research_helper.tracer.trace_log import TraceLogBase
+from research_helper.tracer.run_codec import RunCodec
+from research_helper.tracer.run_store import NO_TIME, to_microseconds
+
+# layout of a binary trace log, all integers are little endian
+#   header   HEADER
+#   index    one RECORD per trace, in the order of the source log
+#   names    json list of the root run names, RECORD.name is an index into it
+#   payloads RunCodec lines, RECORD.offset is relative to the start of the payloads
+MAGIC = b"RHTRACE\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIQQQQ") # magic, version, flags, reserved, count, names offset, names length, payloads offset
+RECORD = np.dtype([("offset", "<u8"), ("length", "<u4"), ("name", "<u4"), ("start_time", "<i8")])
+SORTED_BY_TIME = 1 # flag set when start times never decrease, time ranges are then found by binary search
+
+class ReadOnlyLogError(Exception):
+    pass
+
+class TraceBinaryLog(TraceLogBase):
+    """
+        read-only snapshot of a log, written by convert_log
+
+        the file is memory-mapped, so opening it only reads the header and the names
+        and processes reading the same snapshot share it through the page cache
+    """
+
+    def __init__(self, file_path: str, codec: Optional[RunCodec] = None) -> None:
+        """
+        Args:
+            codec (RunCodec): the codec the snapshot was written with
+        """
+        self._file_path = file_path
+        self._codec = codec or RunCodec()
+        self._lock = threading.RLock()
+
+        with open(file_path, mode="rb") as log_file:
+            self._mmap = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, flags, _, count, names_offset, names_length, payloads_offset = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError(f"{file_path} is not a binary trace log")
+
+        self._sorted = bool(flags & SORTED_BY_TIME)
+        self._payloads_offset = payloads_offset
+        self._records = np.frombuffer(self._mmap, dtype=RECORD, count=count, offset=HEADER.size)
+        self._names: List[str] = orjson.loads(self._mmap[names_offset:names_offset+names_length])
+
+    def add_trace(self, run: Run) -> Union[RunSerializable, None]:
+        raise ReadOnlyLogError(f"{self._file_path} is a read-only snapshot")
+
+    def get_trace(self, offset: int = 0, limit: Optional[int] = None) -> List[RunSerializable]:
+        stop = self.count() if limit is None else min(offset+limit, self.count())
+        return self._load(range(offset, stop))
+
+    def get_trace_between(self, start: datetime, end: datetime) -> List[RunSerializable]:
+        """ traces whose root started in [start, end) """
+        return self._load(self.offsets_between(start, end))
+
+    def offsets_between(self, start: datetime, end: datetime) -> List[int]:
+        """ offsets of the traces whose root started in [start, end), without decoding them """
+        start_times = self._records["start_time"]
+        start_us, end_us = to_microseconds(start), to_microseconds(end)
+        if self._sorted:
+            return list(range(
+                int(np.searchsorted(start_times, start_us, side="left")),
+                int(np.searchsorted(start_times, end_us, side="left")),
+            ))
+        return np.flatnonzero((start_times >= start_us) & (start_times < end_us)).tolist()
+
+    def names(self, offset: int = 0, limit: Optional[int] = None) -> List[str]:
+        """ root run names, without decoding the traces """
+        stop = self.count() if limit is None else min(offset+limit, self.count())
+        return [self._names[name] for name in self._records["name"][offset:stop]]
+
+    def count(self) -> int:
+        return len(self._records)
+
+    def save(self) -> None:
+        """ nothing to save, the snapshot never changes """
+
+    def close(self) -> None:
+        with self._lock:
+            if self._mmap.closed: return
+            self._records = self._records[:0].copy()
+            try:
+                self._mmap.close()
+            except BufferError:
+                """ arrays returned to callers still point into the map, it is closed once they are gone """
+
+    def _load(self, offsets) -> List[RunSerializable]:
+        runs = []
+        with self._lock:
+            for idx in offsets:
+                record = self._records[idx]
+                start = self._payloads_offset+int(record["offset"])
+                runs.append(self._codec.loads(self._mmap[start:start+int(record["length"])]))
+        return runs
+
+    @property
+    def _serialized(self) -> str:
+        with self._lock:
+            if not len(self._records):
+                return ""
+            end = self._payloads_offset+int(self._records["offset"][-1])+int(self._records["length"][-1])
+            return self._mmap[self._payloads_offset:end].decode("utf-8")
+
+def convert_log(source: TraceLogBase, file_path: str, codec: Optional[RunCodec] = None, batch_size: int = 256) -> TraceBinaryLog:
+    """
+    write the traces of a log, e.g. TraceLazyLog over chat.log, as a binary snapshot
+
+    Args:
+        codec (RunCodec): encodes the payloads, must be the codec the snapshot is opened with.
+            a BlobRunCodec keeps referring to the blob store of the source log
+        batch_size (int): number of traces read from the source at once
+    """
+    codec = codec or RunCodec()
+    records = []
+    names: Dict[str, int] = {}
+
+    # payloads go to a temporary file first, their total size is needed before the index is written
+    payloads_path = f"{file_path}.{os.getpid()}.payloads"
+    try:
+        with open(payloads_path, mode="wb") as payloads_file:
+            payloads_size = 0
+            offset = 0
+            while batch := source.get_trace(offset=offset, limit=batch_size):
+                for run in batch:
+                    payload = codec.dumps(run).encode("utf-8")
+                    payloads_file.write(payload)
+                    name = names.setdefault(run.name, len(names))
+                    records.append((payloads_size, len(payload), name, to_microseconds(run.start_time)))
+                    payloads_size += len(payload)
+                offset += len(batch)
+
+        index = np.array(records, dtype=RECORD)
+        start_times = index["start_time"]
+        flags = SORTED_BY_TIME if np.all(start_times != NO_TIME) and np.all(start_times[1:] >= start_times[:-1]) else 0
+        names_data = orjson.dumps(list(names))
+        names_offset = HEADER.size+index.nbytes
+
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(tmp_path, mode="wb") as log_file:
+            log_file.write(HEADER.pack(
+                MAGIC, VERSION, flags, 0, len(index), names_offset, len(names_data), names_offset+len(names_data),
+            ))
+            log_file.write(index.tobytes())
+            log_file.write(names_data)
+            with open(payloads_path, mode="rb") as payloads_file:
+                while chunk := payloads_file.read(1 << 20):
+                    log_file.write(chunk)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(payloads_path):
+            os.remove(payloads_path)
+
+    return TraceBinaryLog(file_path, codec=codec)
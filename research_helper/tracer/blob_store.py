@@ -0,0 +1,53 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Set
+
+import xxhash
+
+class BlobStore:
+    """ content-addressed store of strings, a blob is written once however often it is put """
+    
+    def __init__(self, dir_path: str, cache_size: int = 128) -> None:
+        self.dir_path = dir_path if not dir_path.endswith("/") else dir_path[:-1]
+        if not os.path.isdir(self.dir_path):
+            os.makedirs(self.dir_path)
+        
+        self._cache_size = cache_size
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._known: Set[str] = set() # keys known to be on disk
+    
+    def put(self, data: str) -> str:
+        """ store data and return its key """
+        encoded = data.encode("utf-8")
+        key = xxhash.xxh3_128_hexdigest(encoded)
+        if key in self._known:
+            return key
+        
+        path = self._path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write then rename, a concurrent writer of the same blob writes the same bytes
+            tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+            with open(tmp_path, mode="wb") as blob_file:
+                blob_file.write(encoded)
+            os.replace(tmp_path, path)
+        self._known.add(key)
+        return key
+    
+    def get(self, key: str) -> str:
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        
+        with open(self._path(key), mode="rb") as blob_file:
+            data = blob_file.read().decode("utf-8")
+        
+        self._cache[key] = data
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return data
+    
+    def _path(self, key: str) -> str:
+        # fan out into sub directories to keep directories small
+        return f"{self.dir_path}/{key[:2]}/{key[2:]}"
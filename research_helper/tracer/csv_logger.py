@@ -1,20 +1,70 @@
-from typing import Any, Dict, Literal
+import os
+import io
+import csv
+import threading
+from typing import Any, Dict, List, Literal
 from langchain_core.tracers import BaseTracer
 from langchain_core.tracers.schemas import Run
 import pandas as pd
 
+from research_helper.dataframe.flatten import flatten, to_cell
+
 
 class CsvLogger(BaseTracer):
+    """
+        append one row per finished root run to a headerless csv file
+        
+        the columns are kept in a header sidecar (`<path>.header`). columns which appear later
+        are added at the end of the header, so rows already written stay valid without rewriting the file.
+    """
+    
     def __init__(self, path, _schema_format: Literal['original'] | Literal['streaming_events'] | Literal['original+chat'] = "original", **kwargs: Any) -> None:
         super().__init__(_schema_format=_schema_format, **kwargs)
         
         self._path = path
+        self._header_path = path+".header"
+        self._lock = threading.Lock()
+        self._columns: List[str] = self._load_header()
     
     def _persist_run(self, run: Run) -> None:
-        self.save(run)
+        if run.outputs is not None: # if run finished in error, outputs should be None
+            self.save(run)
     
     def save(self, run: Run) -> None:
         """ serialize and save """
+        row = self._parse(run)
+        with self._lock:
+            new_columns = [column for column in row if column not in self._columns]
+            if new_columns:
+                self._columns.extend(new_columns)
+                self._save_header()
+            
+            buffer = io.StringIO()
+            csv.writer(buffer).writerow([row.get(column) for column in self._columns])
+            with open(self._path, mode="a", encoding="utf-8", newline="") as csv_file:
+                csv_file.write(buffer.getvalue())
+    
+    def _parse(self, run: Run) -> Dict:
+        """ flatten a run into a row with the same columns as the table view """
+        return {key: to_cell(value) for key, value in flatten(run).items()}
+    
+    def _load_header(self) -> List[str]:
+        try:
+            with open(self._header_path, mode="r", encoding="utf-8", newline="") as header_file:
+                return next(csv.reader(header_file), [])
+        except FileNotFoundError:
+            return []
+    
+    def _save_header(self) -> None:
+        with open(self._header_path+".tmp", mode="w", encoding="utf-8", newline="") as header_file:
+            csv.writer(header_file).writerow(self._columns)
+        os.replace(self._header_path+".tmp", self._header_path)
     
-    def _parse(self) -> Dict:
-        """"""
\ No newline at end of file
+    def read(self) -> pd.DataFrame:
+        """ load the logged rows with the columns from the header sidecar """
+        with self._lock:
+            columns = list(self._columns)
+        if not os.path.isfile(self._path):
+            return pd.DataFrame(columns=columns)
+        # rows written before a column was added are shorter, their missing cells become NaN
+        return pd.read_csv(self._path, header=None, names=columns, encoding="utf-8")
@@ -1,51 +1,120 @@
-from typing import Any, Union, Coroutine
+import os
+import json
+import time
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
 from langchain_core.tracers import BaseTracer
 from langchain_core.tracers.schemas import Run
 
+from research_helper.tracer.histogram import Histogram
+
+TOKEN_KEYS = ["prompt_tokens", "completion_tokens", "total_tokens"]
+
+# usage_metadata of chat messages -> token_usage of llm_output
+USAGE_METADATA_KEYS = {
+    "input_tokens": "prompt_tokens",
+    "output_tokens": "completion_tokens",
+    "total_tokens": "total_tokens",
+}
+
+@dataclass
+class RunMetrics:
+    latency: Histogram = field(default_factory=Histogram) # wall time in microseconds
+    errors: int = 0
+    tokens: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(TOKEN_KEYS, 0))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "latency_us": self.latency.snapshot(),
+            "errors": self.errors,
+            "tokens": dict(self.tokens),
+        }
+
+def token_usage(run: Run) -> Dict[str, int]:
+    """ token usage reported by an llm run, empty if the model does not report it """
+    outputs = run.outputs or {}
+    usage = (outputs.get("llm_output") or {}).get("token_usage")
+    if usage:
+        return {key: usage[key] for key in TOKEN_KEYS if isinstance(usage.get(key), int)}
+
+    usage = {}
+    for generations in outputs.get("generations") or []:
+        for generation in generations:
+            message = generation.get("message") or {}
+            # LLMResult.dict() keeps usage_metadata on the message, dumpd nests it in kwargs
+            metadata = message.get("usage_metadata") or (message.get("kwargs") or {}).get("usage_metadata") or {}
+            for key, token_key in USAGE_METADATA_KEYS.items():
+                if isinstance(metadata.get(key), int):
+                    usage[token_key] = usage.get(token_key, 0)+metadata[key]
+    return usage
+
 class ExperimentTracer(BaseTracer):
+    """
+        collects wall time, error counts and token usage per run name and per run_type.
+
+        finished runs are only counted into fixed-size histograms and are not retained.
+    """
+
     def __init__(
-        self, **kwargs: Any
+        self, dump_path: Optional[str] = None, dump_interval: float = 60.0, **kwargs: Any
     ) -> None:
         """
-        Initialize the RunCollectorCallbackHandler.
-
-        Parameters
-        ----------
-        example_id : Optional[Union[UUID, str]], default=None
-            The ID of the example being traced. It can be either a UUID or a string.
-        **kwargs : Any
-            Additional keyword arguments
+        Args:
+            dump_path (Optional[str]): json file the snapshot is written to, no dump if None
+            dump_interval (float): seconds between dumps
         """
         super().__init__(**kwargs)
-        self.traced_runs: list[Run] = []
-
-    
-    def _on_llm_start(self, run: Run) -> Union[None, Coroutine[Any, Any, None]]:
-        print(run.outputs)
-        return super()._on_llm_start(run)
-
-    def _on_llm_end(self, run: Run) -> Union[None, Coroutine[Any, Any, None]]:
-        print(run.outputs)
-        return super()._on_llm_end(run)
-    
-    def _on_chain_start(self, run: Run) -> Union[None, Coroutine[Any, Any, None]]:
-        print(run.outputs)
-        return super()._on_chain_start(run)
-    
-    def _on_chain_end(self, run: Run) -> Union[None, Coroutine[Any, Any, None]]:
-        print(run.outputs)
-        return super()._on_chain_end(run)
-    
+        self._dump_path = dump_path
+        self._dump_interval = dump_interval
+        self._last_dump = time.monotonic()
+        self._lock = threading.Lock()
+
+        self._by_name: Dict[str, RunMetrics] = {}
+        self._by_type: Dict[str, RunMetrics] = {}
+
+    def _on_run_update(self, run: Run) -> None:
+        """ called once for every run when it ends or errors """
+        latency = None
+        if run.end_time is not None:
+            latency = (run.end_time-run.start_time).total_seconds()*1e6
+        usage = token_usage(run) if run.run_type in ("llm", "chat_model") else {}
+
+        with self._lock:
+            for metrics in (
+                self._by_name.setdefault(run.name, RunMetrics()),
+                self._by_type.setdefault(run.run_type, RunMetrics()),
+            ):
+                if latency is not None:
+                    metrics.latency.record(latency)
+                if run.error is not None:
+                    metrics.errors += 1
+                for key, value in usage.items():
+                    metrics.tokens[key] += value
+
+            dump = self._dump_path is not None and time.monotonic()-self._last_dump >= self._dump_interval
+            if dump:
+                self._last_dump = time.monotonic()
+        if dump:
+            self.dump()
+
     def _persist_run(self, run: Run) -> None:
-        """
-        Persist a run by adding it to the traced_runs list.
+        """ runs are aggregated in _on_run_update """
 
-        Parameters
-        ----------
-        run : Run
-            The run to be persisted.
-        """
-        run_ = run.copy()
-        self.traced_runs.append(run_)
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "time": time.time(),
+                "by_name": {name: metrics.snapshot() for name, metrics in self._by_name.items()},
+                "by_run_type": {run_type: metrics.snapshot() for run_type, metrics in self._by_type.items()},
+            }
+
+    def dump(self, path: Optional[str] = None) -> None:
+        path = path or self._dump_path
+        if path is None:
+            raise ValueError("dump_path is not set")
 
-# class ExperimentTracerManager()
\ No newline at end of file
+        tmp_path = path+".tmp"
+        with open(tmp_path, mode="w", encoding="utf-8") as dump_file:
+            json.dump(self.snapshot(), dump_file, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
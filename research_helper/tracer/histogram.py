@@ -0,0 +1,65 @@
+from typing import Dict, List, Tuple
+
+class Histogram:
+    """
+        fixed-size log-linear histogram of non-negative integers (HDR-style)
+
+        values below 2**(precision+1) have a bucket each, above that every power of two
+        is split into 2**precision buckets, so the relative error is at most 2**-precision.
+    """
+
+    def __init__(self, precision: int = 5, max_bits: int = 40) -> None:
+        """
+        Args:
+            precision (int): number of sub-bucket bits
+            max_bits (int): values are clamped to 2**max_bits-1
+        """
+        self._precision = precision
+        self._max_value = (1 << max_bits)-1
+        self._counts: List[int] = [0]*self._index(self._max_value)+[0]
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def record(self, value: int) -> None:
+        value = min(max(int(value), 0), self._max_value)
+        self._counts[self._index(value)] += 1
+        self.min = value if self.count == 0 else min(self.min, value)
+        self.max = max(self.max, value)
+        self.count += 1
+        self.total += value
+
+    def _index(self, value: int) -> int:
+        shift = max(value.bit_length()-self._precision-1, 0)
+        return (shift << self._precision)+(value >> shift)
+
+    def _bounds(self, index: int) -> Tuple[int, int]:
+        shift = max((index >> self._precision)-1, 0)
+        lower = (index-(shift << self._precision)) << shift
+        return lower, lower+(1 << shift)-1
+
+    def quantile(self, q: float) -> int:
+        """ upper bound of the bucket holding the q-quantile, 0 if empty """
+        if self.count == 0:
+            return 0
+        rank = max(q*self.count, 1)
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return min(self._bounds(index)[1], self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total/self.count if self.count else 0.0
+
+    def snapshot(self, quantiles: Tuple[float, ...] = (0.5, 0.9, 0.99)) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "min": self.min,
+            "max": self.max,
+            **{f"p{round(q*100):d}": self.quantile(q) for q in quantiles},
+        }
@@ -0,0 +1,284 @@
+import os
+import json
+import uuid
+import threading
+from datetime import datetime, timezone
+from contextlib import nullcontext
+from collections import OrderedDict
+from typing import Union, List, Optional, Tuple, Dict
+from filelock import FileLock
+from langchain_core.tracers.schemas import Run
+
+from research_helper.schemas.run import RunSerializable
+from research_helper.schemas.trace import TraceListSerializable
+from research_helper.tracer.trace_log import TraceLogBase, page
+from research_helper.tracer.run_codec import RunCodec
+
+def is_legacy_log(data: bytes) -> bool:
+    """ whether data is the single-document {"traces": [...]} format written by TraceLog """
+    first_line = data.lstrip().split(b"\n", 1)[0].strip()
+    # TraceLog writes with indent=2, so the document starts with a lone "{"
+    return first_line == b"{" or first_line.startswith(b'{"traces"')
+
+def repair_tail(file_path: str, valid_end: int) -> None:
+    """ drop a partially written final line so that following appends start on a fresh line """
+    with open(file_path, mode="r+b") as log_file:
+        log_file.truncate(valid_end)
+        if valid_end > 0:
+            log_file.seek(valid_end-1)
+            if log_file.read(1) != b"\n":
+                log_file.write(b"\n")
+
+class TraceJsonlLog(TraceLogBase):
+    """ append-only log which keeps one compact json line per root run """
+
+    def __init__(self, file_path: str, codec: Optional[RunCodec] = None) -> None:
+        self._file_path = file_path
+        self._codec = codec or RunCodec()
+        self._trace_list = TraceListSerializable()
+        self._unsaved: List[RunSerializable] = []
+        self._rewrite = False # True while the file on disk is still in the legacy format
+        self._load_log()
+
+    def add_trace(self, run: Run) -> Union[RunSerializable, None]:
+        if not self._is_trace(run):
+            return None
+        added_run = self._trace_list.add_trace(run)
+        self._unsaved.append(added_run)
+        return added_run
+
+    def _is_trace(self, run: Run):
+        return run.parent_run_id is None
+
+    def get_trace(self, offset: int = 0, limit: Optional[int] = None) -> List[RunSerializable]:
+        return page(self._trace_list.traces, offset, limit)
+
+    def save(self) -> None:
+        if self._rewrite:
+            # convert the legacy document once, then keep appending
+            tmp_path = self._file_path+".tmp"
+            with open(tmp_path, mode="w", encoding="utf-8") as log_file:
+                log_file.write(self._serialized)
+            os.replace(tmp_path, self._file_path)
+            self._rewrite = False
+        elif self._unsaved:
+            with open(self._file_path, mode="a", encoding="utf-8") as log_file:
+                log_file.write("".join(self._codec.dumps(run) for run in self._unsaved))
+        self._unsaved = []
+
+    def _load_log(self) -> None:
+        try:
+            with open(self._file_path, mode="rb") as log_file:
+                data = log_file.read()
+        except FileNotFoundError:
+            return
+
+        if is_legacy_log(data):
+            try:
+                self._trace_list = TraceListSerializable(**json.loads(data))
+                self._rewrite = True
+            except:
+                # broken legacy log, keep it aside and start from empty,
+                # lines appended after the broken document would never be read back
+                os.replace(self._file_path, self._file_path+".broken")
+            return
+
+        offset = 0
+        valid_end = 0 # end of the last line which could be parsed
+        for line in data.splitlines(keepends=True):
+            offset += len(line)
+            if not line.strip():
+                continue
+            try:
+                self._trace_list.traces.append(self._codec.loads(line))
+                valid_end = offset
+            except:
+                """ skip a broken record, a truncated tail is cut off below """
+
+        if data and (valid_end < len(data) or not data.endswith(b"\n")):
+            repair_tail(self._file_path, valid_end)
+
+    @property
+    def _serialized(self) -> str:
+        return "".join(self._codec.dumps(run) for run in self._trace_list.traces)
+
+
+SCAN_CHUNK_SIZE = 1 << 20
+
+def is_complete_record(line: bytes) -> bool:
+    """ cheap check that a line is a whole json object, so lines cut off by a crash are not indexed """
+    line = line.strip()
+    return line.startswith(b"{") and line.endswith(b"}")
+
+def broken_record(file_path: str, offset: int, error: Exception) -> RunSerializable:
+    """ stands in for a line which is indexed but cannot be parsed, so that the offsets of later traces do not shift """
+    return RunSerializable(
+        id=uuid.uuid5(uuid.NAMESPACE_URL, f"{os.path.abspath(file_path)}#{offset}"),
+        name="broken record",
+        run_type="chain",
+        start_time=datetime.fromtimestamp(0, tz=timezone.utc),
+        outputs={}, # finished, with the reason in error
+        error=f"{type(error).__name__}: {error}",
+    )
+
+class TraceLazyLog(TraceLogBase):
+    """
+        jsonl log which only indexes the byte offset of each line on open
+        and parses a run when it is accessed.
+    """
+
+    def __init__(self, file_path: str, cache_size: int = 256, codec: Optional[RunCodec] = None, shared: bool = False) -> None:
+        """
+        Args:
+            cache_size (int): number of parsed runs kept in memory
+            shared (bool): whether other sessions or processes append to the same file.
+                every trace is appended under `<file_path>.lock` as soon as it is added,
+                so that its offset never changes, and lines appended by others are indexed on access
+        """
+        self._file_path = file_path
+        self._codec = codec or RunCodec()
+        self._cache_size = cache_size
+        self._shared = shared
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(file_path+".lock") if shared else nullcontext()
+
+        self._offsets: List[Tuple[int, int]] = [] # (offset, length) of every saved trace
+        self._scanned = 0 # bytes of the file indexed so far
+        self._unsaved: List[RunSerializable] = []
+        self._cache: "OrderedDict[int, RunSerializable]" = OrderedDict()
+
+        with self._file_lock:
+            self._convert_legacy()
+            self._scan(repair=True)
+
+    def add_trace(self, run: Run) -> Union[RunSerializable, None]:
+        if not self._is_trace(run):
+            return None
+        added_run = run if isinstance(run, RunSerializable) else RunSerializable.from_run(run)
+        with self._lock:
+            self._unsaved.append(added_run)
+            if self._shared:
+                # an unsaved trace would move behind lines which other writers append meanwhile
+                self.save()
+        return added_run
+
+    def _is_trace(self, run: Run):
+        return run.parent_run_id is None
+
+    def get_trace(self, offset: int = 0, limit: Optional[int] = None) -> List[RunSerializable]:
+        with self._lock:
+            count = self.count() # picks up lines of other writers
+            stop = count if limit is None else min(offset+limit, count)
+            saved = len(self._offsets)
+            traces = self._load(range(offset, min(stop, saved)))
+            traces.extend(self._unsaved[max(offset-saved, 0):max(stop-saved, 0)])
+            return traces
+
+    def count(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._offsets)+len(self._unsaved)
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._unsaved: return
+
+            with self._file_lock:
+                self._scan() # lines appended by others come before ours
+                saved = len(self._offsets)
+                with open(self._file_path, mode="a", encoding="utf-8") as log_file:
+                    log_file.write("".join(self._codec.dumps(run) for run in self._unsaved))
+                self._scan()
+            for idx, run in enumerate(self._unsaved):
+                self._remember(saved+idx, run)
+            self._unsaved = []
+
+    def _load(self, indices: range) -> List[RunSerializable]:
+        runs: Dict[int, RunSerializable] = {}
+        missing = []
+        for idx in indices:
+            if idx in self._cache:
+                self._cache.move_to_end(idx)
+                runs[idx] = self._cache[idx]
+            else:
+                missing.append(idx)
+
+        if missing:
+            with open(self._file_path, mode="rb") as log_file:
+                for idx in missing:
+                    offset, length = self._offsets[idx]
+                    log_file.seek(offset)
+                    try:
+                        runs[idx] = self._codec.loads(log_file.read(length))
+                    except Exception as e:
+                        runs[idx] = broken_record(self._file_path, offset, e)
+                    self._remember(idx, runs[idx])
+
+        return [runs[idx] for idx in indices]
+
+    def _remember(self, idx: int, run: RunSerializable) -> None:
+        self._cache[idx] = run
+        self._cache.move_to_end(idx)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def _refresh(self) -> None:
+        """ index lines appended by other writers """
+        if not self._shared: return
+        try:
+            if os.path.getsize(self._file_path) > self._scanned:
+                self._scan()
+        except FileNotFoundError:
+            return
+
+    def _scan(self, repair: bool = False) -> None:
+        """ index the lines appended since the last scan """
+        try:
+            log_file = open(self._file_path, mode="rb")
+        except FileNotFoundError:
+            return
+
+        with log_file:
+            log_file.seek(self._scanned)
+            offset = self._scanned
+            tail = b"" # incomplete last line
+            while chunk := log_file.read(SCAN_CHUNK_SIZE):
+                lines = (tail+chunk).split(b"\n")
+                tail = lines.pop()
+                for line in lines:
+                    # offsets stay dense, get_trace returns a trace for every indexed line
+                    if is_complete_record(line):
+                        self._offsets.append((offset, len(line)))
+                    offset += len(line)+1
+        self._scanned = offset
+
+        if repair and tail.strip():
+            try:
+                self._codec.loads(tail)
+            except:
+                repair_tail(self._file_path, offset) # truncated while writing
+                return
+            repair_tail(self._file_path, offset+len(tail))
+            self._offsets.append((offset, len(tail)))
+            self._scanned = offset+len(tail)+1
+
+    def _convert_legacy(self) -> None:
+        try:
+            with open(self._file_path, mode="rb") as log_file:
+                head = log_file.read(64)
+        except FileNotFoundError:
+            return
+
+        if is_legacy_log(head):
+            legacy_log = TraceJsonlLog(self._file_path, codec=self._codec)
+            legacy_log.save()
+
+    @property
+    def _serialized(self) -> str:
+        with self._lock:
+            try:
+                with open(self._file_path, mode="r", encoding="utf-8") as log_file:
+                    saved = log_file.read()
+            except FileNotFoundError:
+                saved = ""
+            return saved+"".join(self._codec.dumps(run) for run in self._unsaved)
@@ -0,0 +1,92 @@
+from typing import Any, Dict, List
+
+import orjson
+
+from research_helper.schemas.run import RunSerializable
+from research_helper.tracer.blob_store import BlobStore
+
+class RunCodec:
+    """ encodes a trace into one line of a jsonl log and back """
+    
+    def __init__(self, trusted: bool = True) -> None:
+        """
+        Args:
+            trusted (bool): lines were written by this codec, so a run is constructed without validating every field
+        """
+        self._trusted = trusted
+    
+    def dumps(self, run: RunSerializable) -> str:
+        # pydantic's own encoder is as fast as orjson on a model, see benchmarks/trace_codec.py
+        return run.model_dump_json()+"\n"
+    
+    def loads(self, line: bytes) -> RunSerializable:
+        return self._decode(orjson.loads(line))
+    
+    def _decode(self, data: Dict[str, Any]) -> RunSerializable:
+        if self._trusted:
+            return RunSerializable.from_trusted_json(data)
+        return RunSerializable.model_validate(data)
+
+BLOB_REF = "__blob__"
+
+class BlobRunCodec(RunCodec):
+    """
+        stores long strings of inputs/outputs in a BlobStore and keeps only {"__blob__": <hash>} in the line,
+        so a prompt repeated in a parent run, the prompt node and every branch is written once
+    """
+    PAYLOAD_FIELDS = ["inputs", "outputs"]
+    
+    def __init__(self, blob_store: BlobStore, min_size: int = 256, trusted: bool = True) -> None:
+        """
+        Args:
+            min_size (int): strings shorter than this stay inline
+        """
+        super().__init__(trusted=trusted)
+        self._blob_store = blob_store
+        self._min_size = min_size
+    
+    def dumps(self, run: RunSerializable) -> str:
+        data = run.model_dump() # UUID and datetime are left to orjson
+        keys: Dict[str, str] = {} # blob key of each string already stored while encoding this run
+        
+        def to_ref(value: str) -> Dict[str, str]:
+            if value not in keys:
+                keys[value] = self._blob_store.put(value)
+            return {BLOB_REF: keys[value]}
+        
+        for node in self._nodes(data):
+            for field in BlobRunCodec.PAYLOAD_FIELDS:
+                node[field] = self._replace(
+                    node[field],
+                    is_target=lambda value: isinstance(value, str) and len(value) >= self._min_size,
+                    replace=to_ref,
+                )
+        return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z).decode("utf-8")
+    
+    def loads(self, line: bytes) -> RunSerializable:
+        data = orjson.loads(line)
+        for node in self._nodes(data):
+            for field in BlobRunCodec.PAYLOAD_FIELDS:
+                node[field] = self._replace(
+                    node[field],
+                    is_target=lambda value: isinstance(value, dict) and len(value) == 1 and BLOB_REF in value,
+                    replace=lambda ref: self._blob_store.get(ref[BLOB_REF]),
+                )
+        return self._decode(data)
+    
+    def _nodes(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        nodes, stack = [], [data]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(node.get("child_runs") or [])
+        return nodes
+    
+    def _replace(self, value: Any, is_target, replace) -> Any:
+        if is_target(value):
+            return replace(value)
+        if isinstance(value, dict):
+            return {key: self._replace(item, is_target, replace) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._replace(item, is_target, replace) for item in value]
+        return value
@@ -0,0 +1,96 @@
+from abc import ABC
+from typing import Any, List, Optional
+from langchain_core.tracers.schemas import Run
+
+REDANDANT_EVENTS = [
+    "new_token",
+]
+
+class RunFilter(ABC):
+    """ one stage of RunFilterPipeline, every node of a trace goes through keep and then apply """
+
+    def keep(self, run: Run, depth: int) -> bool:
+        """ False to drop the run and its children from the trace, the root (depth 0) is always kept """
+        return True
+
+    def apply(self, run: Run, depth: int) -> None:
+        """ edit the run in place """
+
+class DropEvents(RunFilter):
+    def __init__(self, names: List[str] = REDANDANT_EVENTS) -> None:
+        self._names = set(names)
+
+    def apply(self, run: Run, depth: int) -> None:
+        run.events = [event for event in run.events if event["name"] not in self._names]
+
+class AggregateTokenEvents(RunFilter):
+    """ count token events into run.extra["token_events"] with the latency of the first one, place before DropEvents """
+
+    def __init__(self, name: str = "new_token") -> None:
+        self._name = name
+
+    def apply(self, run: Run, depth: int) -> None:
+        times = [event["time"] for event in run.events if event["name"] == self._name]
+        if not times:
+            return
+        run.extra = {
+            **(run.extra or {}),
+            "token_events": {
+                "count": len(times),
+                "first_token_latency": (min(times)-run.start_time).total_seconds(),
+            },
+        }
+
+class TruncatePayloads(RunFilter):
+    """ cut strings in inputs/outputs longer than max_length """
+
+    def __init__(self, max_length: int = 10000) -> None:
+        self._max_length = max_length
+
+    def apply(self, run: Run, depth: int) -> None:
+        run.inputs = self._truncate(run.inputs)
+        if run.outputs is not None:
+            run.outputs = self._truncate(run.outputs)
+
+    def _truncate(self, value: Any) -> Any:
+        if isinstance(value, str) and len(value) > self._max_length:
+            return value[:self._max_length]+f"...[{len(value)-self._max_length} chars truncated]"
+        if isinstance(value, dict):
+            return {key: self._truncate(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._truncate(item) for item in value]
+        return value
+
+class PruneChildRuns(RunFilter):
+    """ drop child runs by name, or deeper than max_depth """
+
+    def __init__(self, names: List[str] = [], max_depth: Optional[int] = None) -> None:
+        self._names = set(names)
+        self._max_depth = max_depth
+
+    def keep(self, run: Run, depth: int) -> bool:
+        if run.name in self._names:
+            return False
+        return self._max_depth is None or depth <= self._max_depth
+
+DEFAULT_FILTERS = [AggregateTokenEvents(), DropEvents()]
+
+class RunFilterPipeline:
+    """ runs the filters over a trace in one iterative pass """
+
+    def __init__(self, filters: Optional[List[RunFilter]] = None) -> None:
+        self._filters = filters if filters is not None else DEFAULT_FILTERS
+
+    def apply(self, run: Run) -> Run:
+        stack = [(run, 0)]
+        while stack:
+            node, depth = stack.pop()
+            for run_filter in self._filters:
+                run_filter.apply(node, depth)
+            if node.child_runs:
+                node.child_runs = [
+                    child for child in node.child_runs
+                    if all(run_filter.keep(child, depth+1) for run_filter in self._filters)
+                ]
+                stack.extend((child, depth+1) for child in node.child_runs)
+        return run
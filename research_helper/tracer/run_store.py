@@ -0,0 +1,295 @@
+import threading
+from datetime import datetime, timedelta, timezone
+from functools import cached_property
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import orjson
+from langchain_core.tracers.schemas import Run
+
+from research_helper.schemas.run import RunSerializable
+from research_helper.tracer.trace_log import TraceLogBase
+from research_helper.tracer.jsonl_trace_log import TraceJsonlLog, is_legacy_log, repair_tail
+from research_helper.tracer.run_codec import RunCodec
+
+NO_TIME = np.iinfo(np.int64).min
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# fields kept in the arrays, everything else of a node goes into its payload
+ARRAY_FIELDS = {"child_runs", "name", "run_type", "start_time", "end_time"}
+
+def to_microseconds(time: Optional[datetime]) -> int:
+    if time is None:
+        return NO_TIME
+    return (time-EPOCH)//timedelta(microseconds=1) if time.tzinfo else round(time.timestamp()*1e6)
+
+def from_microseconds(value: int) -> Optional[datetime]:
+    return None if value == NO_TIME else EPOCH+timedelta(microseconds=int(value))
+
+class _Column:
+    """ numpy array which grows by doubling """
+
+    def __init__(self, dtype: Any, capacity: int = 1024) -> None:
+        self._data = np.empty(capacity, dtype=dtype)
+        self._size = 0
+
+    def append(self, value: Any) -> None:
+        if self._size == len(self._data):
+            data = np.empty(len(self._data)*2, dtype=self._data.dtype)
+            data[:self._size] = self._data
+            self._data = data
+        self._data[self._size] = value
+        self._size += 1
+
+    def __getitem__(self, idx: int) -> Any:
+        return self._data[idx]
+
+    def __setitem__(self, idx: int, value: Any) -> None:
+        self._data[idx] = value
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def array(self) -> np.ndarray:
+        return self._data[:self._size]
+
+class RunStore:
+    """
+        run trees in parallel arrays, one entry per node
+
+        names and run types are interned, times are int64 microseconds
+        and the rest of a node is kept as a json payload which is decoded on access.
+    """
+
+    def __init__(self) -> None:
+        self._strings: List[str] = []
+        self._string_ids: Dict[str, int] = {}
+
+        self._parent = _Column(np.int32)
+        self._first_child = _Column(np.int32)
+        self._next_sibling = _Column(np.int32)
+        self._name = _Column(np.int32)
+        self._run_type = _Column(np.int32)
+        self._start_time = _Column(np.int64)
+        self._end_time = _Column(np.int64)
+        self._payload_offset = _Column(np.int64)
+        self._payload_length = _Column(np.int32)
+        self._payload = bytearray()
+        self._roots = _Column(np.int32) # node of every trace
+
+    def add(self, run: RunSerializable) -> int:
+        """ store a trace and return its index """
+        root = len(self._parent)
+        last_child: Dict[int, int] = {}
+        stack: List[Tuple[RunSerializable, int]] = [(run, -1)]
+        while stack:
+            node, parent = stack.pop()
+            idx = len(self._parent)
+            payload = node.model_dump_json(exclude=ARRAY_FIELDS).encode("utf-8")
+
+            self._parent.append(parent)
+            self._first_child.append(-1)
+            self._next_sibling.append(-1)
+            self._name.append(self._intern(node.name))
+            self._run_type.append(self._intern(node.run_type))
+            self._start_time.append(to_microseconds(node.start_time))
+            self._end_time.append(to_microseconds(node.end_time))
+            self._payload_offset.append(len(self._payload))
+            self._payload_length.append(len(payload))
+            self._payload.extend(payload)
+
+            if parent >= 0:
+                if parent in last_child:
+                    self._next_sibling[last_child[parent]] = idx
+                else:
+                    self._first_child[parent] = idx
+                last_child[parent] = idx
+            # reversed so that siblings are stored in order
+            stack.extend((child, idx) for child in reversed(node.child_runs))
+
+        self._roots.append(root)
+        return len(self._roots)-1
+
+    def _intern(self, string: str) -> int:
+        if string not in self._string_ids:
+            self._string_ids[string] = len(self._strings)
+            self._strings.append(string)
+        return self._string_ids[string]
+
+    def __len__(self) -> int:
+        return len(self._roots)
+
+    def trace(self, idx: int) -> "RunView":
+        return RunView(self, int(self._roots[idx]))
+
+    def traces(self, offset: int = 0, limit: Optional[int] = None) -> List["RunView"]:
+        stop = len(self) if limit is None else min(offset+limit, len(self))
+        return [self.trace(idx) for idx in range(offset, stop)]
+
+    def children(self, node: int) -> List[int]:
+        children = []
+        child = self._first_child[node]
+        while child >= 0:
+            children.append(int(child))
+            child = self._next_sibling[child]
+        return children
+
+    def string(self, string_id: int) -> str:
+        return self._strings[string_id]
+
+    def payload(self, node: int) -> bytes:
+        offset = self._payload_offset[node]
+        return bytes(self._payload[offset:offset+self._payload_length[node]])
+
+    def durations(self) -> np.ndarray:
+        """ seconds of every node, nan if it has not finished """
+        start, end = self._start_time.array, self._end_time.array
+        return np.where(end != NO_TIME, (end-start)/1e6, np.nan)
+
+    def latency_by_name(self) -> Dict[str, Tuple[int, float]]:
+        """ (number of finished runs, total seconds) of every run name """
+        durations = self.durations()
+        finished = ~np.isnan(durations)
+        names = self._name.array[finished]
+        counts = np.bincount(names, minlength=len(self._strings))
+        totals = np.bincount(names, weights=durations[finished], minlength=len(self._strings))
+        return {
+            string: (int(counts[string_id]), float(totals[string_id]))
+            for string_id, string in enumerate(self._strings) if counts[string_id]
+        }
+
+    @property
+    def nbytes(self) -> int:
+        columns = [
+            self._parent, self._first_child, self._next_sibling, self._name, self._run_type,
+            self._start_time, self._end_time, self._payload_offset, self._payload_length, self._roots,
+        ]
+        return sum(column.array.nbytes for column in columns)+len(self._payload)
+
+class RunView:
+    """
+        read-only node of a RunStore with the attributes of RunSerializable,
+        fields other than the tree, names and times are decoded from the payload on first access
+    """
+
+    def __init__(self, store: RunStore, node: int) -> None:
+        self._store = store
+        self._node = node
+
+    @property
+    def name(self) -> str:
+        return self._store.string(self._store._name[self._node])
+
+    @property
+    def run_type(self) -> str:
+        return self._store.string(self._store._run_type[self._node])
+
+    @property
+    def start_time(self) -> datetime:
+        return from_microseconds(self._store._start_time[self._node])
+
+    @property
+    def end_time(self) -> Optional[datetime]:
+        return from_microseconds(self._store._end_time[self._node])
+
+    @property
+    def child_runs(self) -> List["RunView"]:
+        return [RunView(self._store, child) for child in self._store.children(self._node)]
+
+    @cached_property
+    def _fields(self) -> RunSerializable:
+        data = orjson.loads(self._store.payload(self._node))
+        data.update(name=self.name, run_type=self.run_type, start_time=self.start_time, end_time=self.end_time)
+        return RunSerializable.model_validate(data)
+
+    def __getattr__(self, attr: str) -> Any:
+        # id, inputs, outputs, error, events, tags ...
+        if attr.startswith("_") or attr not in RunSerializable.model_fields:
+            raise AttributeError(attr)
+        return getattr(self._fields, attr)
+
+    def to_run(self) -> RunSerializable:
+        """ the whole subtree as RunSerializable """
+        root = None
+        stack: List[Tuple[RunView, Optional[RunSerializable]]] = [(self, None)]
+        while stack:
+            view, parent = stack.pop()
+            node = view._fields.model_copy(update={"child_runs": []})
+            if parent is None:
+                root = node
+            else:
+                parent.child_runs.append(node)
+            stack.extend((child, node) for child in reversed(view.child_runs))
+        return root
+
+
+class TraceArrayLog(TraceLogBase):
+    """ jsonl log held in a RunStore, for large logs which are read as a whole """
+
+    def __init__(self, file_path: str, codec: Optional[RunCodec] = None) -> None:
+        self._file_path = file_path
+        self._codec = codec or RunCodec()
+        self._lock = threading.RLock()
+        self._store = RunStore()
+        self._unsaved: List[RunSerializable] = []
+        self._load_log()
+
+    def add_trace(self, run: Run) -> Union[RunSerializable, None]:
+        if not self._is_trace(run):
+            return None
+        added_run = run if isinstance(run, RunSerializable) else RunSerializable.from_run(run)
+        with self._lock:
+            self._store.add(added_run)
+            self._unsaved.append(added_run)
+        return added_run
+
+    def _is_trace(self, run: Run):
+        return run.parent_run_id is None
+
+    def get_trace(self, offset: int = 0, limit: Optional[int] = None) -> List[RunView]:
+        with self._lock:
+            return self._store.traces(offset, limit)
+
+    def count(self) -> int:
+        return len(self._store)
+
+    @property
+    def store(self) -> RunStore:
+        return self._store
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._unsaved: return
+            with open(self._file_path, mode="a", encoding="utf-8") as log_file:
+                log_file.write("".join(self._codec.dumps(run) for run in self._unsaved))
+            self._unsaved = []
+
+    def _load_log(self) -> None:
+        try:
+            with open(self._file_path, mode="rb") as log_file:
+                head = log_file.read(64)
+        except FileNotFoundError:
+            return
+        if is_legacy_log(head):
+            TraceJsonlLog(self._file_path, codec=self._codec).save()
+
+        with open(self._file_path, mode="rb") as log_file:
+            offset = 0
+            valid_end = 0
+            for line in log_file:
+                offset += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    self._store.add(self._codec.loads(line))
+                    valid_end = offset
+                except:
+                    """ skip a broken record, a truncated tail is cut off below """
+
+        if offset and (valid_end < offset or not line.endswith(b"\n")):
+            repair_tail(self._file_path, valid_end)
+
+    @property
+    def _serialized(self) -> str:
+        return "".join(self._codec.dumps(view.to_run()) for view in self.get_trace())
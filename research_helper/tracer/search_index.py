@@ -0,0 +1,245 @@
+import re
+import os
+import sqlite3
+import threading
+from array import array
+from typing import Union, Dict, List, Optional, Set, Tuple
+from langchain_core.tracers.schemas import Run
+
+from research_helper.schemas.run import RunSerializable
+from research_helper.dataframe.flatten import serialize, to_cell
+from research_helper.tracer.trace_log import TraceLogBase, TraceLogDecorator
+
+# kana, CJK ideographs and hangul have no spaces between words, they are indexed one character at a time
+CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+TOKEN_PATTERN = re.compile(f"[{CJK}]|[^\\W_{CJK}]+")
+QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+
+# postings are only deleted when the offsets of a shared log moved, which is rare enough to scan for
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    doc INTEGER PRIMARY KEY,
+    id  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term      TEXT NOT NULL,
+    doc       INTEGER NOT NULL,
+    positions BLOB NOT NULL,
+    PRIMARY KEY (term, doc)
+) WITHOUT ROWID;
+"""
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+def trace_text(run: RunSerializable) -> List[str]:
+    """ serialized inputs and outputs of the root run, child runs mostly pass the same text around """
+    return [
+        cell for values in (run.inputs, run.outputs or {}) for value in values.values()
+        if isinstance(cell := to_cell(serialize(value)), str)
+    ]
+
+class InvertedIndex:
+    """
+        positional inverted index of traces, kept in sqlite so that only the postings of the searched terms are read
+
+        a trace is numbered by its offset in the log, like the offsets of TraceLogBase.get_trace
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self._file_path = file_path
+        self._remove_legacy()
+        # streamlit reruns a script on different threads
+        self._connection = sqlite3.connect(file_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # the index can be rebuilt from the log, a commit does not wait for the disk
+        self._connection.execute("PRAGMA synchronous=OFF")
+        self._connection.executescript(SCHEMA)
+        self._connection.commit()
+
+    def add(self, offset: int, runs: List[RunSerializable]) -> None:
+        """ index runs as the traces from `offset` on, traces already indexed by another writer are skipped """
+        postings: Dict[str, List[Tuple[int, bytes]]] = {} # term -> (doc, positions) of the new traces
+        with self._connection:
+            for doc, run in enumerate(runs, start=offset):
+                cursor = self._connection.execute("INSERT OR IGNORE INTO docs (doc, id) VALUES (?, ?)", (doc, str(run.id)))
+                if not cursor.rowcount:
+                    continue
+                terms: Dict[str, array] = {}
+                position = 0
+                for text in trace_text(run):
+                    for token in tokenize(text):
+                        terms.setdefault(token, array("I")).append(position)
+                        position += 1
+                    position += 1 # phrases do not span fields
+                for term, positions in terms.items():
+                    postings.setdefault(term, []).append((doc, positions.tobytes()))
+            # in key order, so that inserting touches each page of the table once
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO postings (term, doc, positions) VALUES (?, ?, ?)",
+                ((term, doc, positions) for term in sorted(postings) for doc, positions in postings[term]),
+            )
+
+    def __len__(self) -> int:
+        """ offset right after the last indexed trace """
+        return self._connection.execute("SELECT COALESCE(MAX(doc)+1, 0) FROM docs").fetchone()[0]
+
+    def search(self, query: str) -> List[int]:
+        """
+        traces matching every term and "quoted phrase" of the query, in the order they were added.
+        a term of several tokens such as a CJK word is matched as a phrase.
+        """
+        docs: Optional[Set[int]] = None
+        for phrase, term in QUERY_PATTERN.findall(query):
+            tokens = tokenize(phrase or term)
+            if not tokens:
+                continue
+            docs = self._match_phrase(tokens, docs)
+            if not docs:
+                return []
+        return sorted(docs or [])
+
+    def _match_phrase(self, tokens: List[str], candidates: Optional[Set[int]]) -> Set[int]:
+        # start from the rarest token
+        docs = candidates
+        for token in sorted(set(tokens), key=self._frequency):
+            found = {doc for doc, in self._connection.execute("SELECT doc FROM postings WHERE term = ?", (token,))}
+            docs = found if docs is None else docs & found
+            if not docs:
+                return set()
+        if len(tokens) == 1:
+            return docs
+
+        positions = {token: self._positions(token, docs) for token in set(tokens)}
+        matched = set()
+        for doc in docs:
+            following = [positions[token][doc] for token in tokens[1:]]
+            if any(all(start+idx+1 in following[idx] for idx in range(len(following))) for start in positions[tokens[0]][doc]):
+                matched.add(doc)
+        return matched
+
+    def _frequency(self, token: str) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM postings WHERE term = ?", (token,)).fetchone()[0]
+
+    def _positions(self, token: str, docs: Set[int]) -> Dict[int, Set[int]]:
+        rows = self._connection.execute("SELECT doc, positions FROM postings WHERE term = ?", (token,))
+        return {doc: set(array("I", positions)) for doc, positions in rows if doc in docs}
+
+    def ids(self, docs: List[int]) -> List[str]:
+        ids = {}
+        for doc in docs:
+            row = self._connection.execute("SELECT id FROM docs WHERE doc = ?", (doc,)).fetchone()
+            ids[doc] = row[0] if row else None
+        return [ids[doc] for doc in docs]
+
+    def truncate(self, size: int) -> None:
+        """ drop the traces from `size` on """
+        if size >= len(self): return
+        with self._connection:
+            self._connection.execute("DELETE FROM docs WHERE doc >= ?", (size,))
+            self._connection.execute("DELETE FROM postings WHERE doc >= ?", (size,))
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _remove_legacy(self) -> None:
+        """ the json lines index of older versions, it is rebuilt from the log """
+        try:
+            with open(self._file_path, mode="rb") as index_file:
+                header = index_file.read(len(SQLITE_HEADER))
+        except FileNotFoundError:
+            return
+        if header and header != SQLITE_HEADER:
+            os.remove(self._file_path)
+
+
+class TraceSearchIndexLog(TraceLogDecorator):
+    """
+        indexes the inputs and outputs of traces for full-text search
+
+        nothing is read on open, the index catches up with the log on the first search
+        and from then on traces are indexed as they are added.
+        traces which come from other writers of a shared log are indexed when searching
+    """
+
+    def __init__(self, component: TraceLogBase, index_path: str, batch_size: int = 256) -> None:
+        """
+        Args:
+            index_path (str): sqlite file the index is kept in, next to the log.
+                traces missing from it are indexed on the next search
+            batch_size (int): number of traces read at once when indexing an existing log
+        """
+        super().__init__(component)
+        self._lock = threading.RLock()
+        self._index = InvertedIndex(index_path)
+        self._indexed: Optional[int] = None # offset right after the last indexed trace, None until the first search
+
+        self._batch_size = batch_size
+
+    def add_trace(self, run: Run) -> Union[RunSerializable, None]:
+        # appended and numbered under one lock, so concurrent callbacks cannot swap doc numbers
+        with self._lock:
+            added_run = self._component.add_trace(run)
+            if added_run and self._indexed is not None and self._indexed == self._component.count()-1:
+                self._index.add(self._indexed, [added_run])
+                self._indexed += 1
+        return added_run
+
+    def _catch_up(self) -> None:
+        """ make the index match the log """
+        # drop indexed traces which are no longer at the same offset,
+        # e.g. unsaved traces which lines of another writer were put before.
+        # offsets only move from some trace on, so the first moved one is found by bisection
+        count = self._component.count()
+        indexed = min(len(self._index), count)
+        if indexed > 0 and not self._is_indexed(indexed-1):
+            low, high = 0, indexed-1 # docs before low are in place, high is not
+            while low < high:
+                mid = (low+high)//2
+                if self._is_indexed(mid):
+                    low = mid+1
+                else:
+                    high = mid
+            indexed = low
+        self._index.truncate(indexed)
+
+        # index traces which were logged without the index, only [indexed, count) is read
+        offset = indexed
+        while offset < count and (batch := self._component.get_trace(offset=offset, limit=min(self._batch_size, count-offset))):
+            self._index.add(offset, batch)
+            offset += len(batch)
+        self._indexed = offset
+
+    def _is_indexed(self, doc: int) -> bool:
+        traces = self._component.get_trace(offset=doc, limit=1)
+        return bool(traces) and str(traces[0].id) == self._index.ids([doc])[0]
+
+    def search(self, query: str) -> List[str]:
+        """ run ids of the traces matching the query, see InvertedIndex.search """
+        with self._lock:
+            self._catch_up()
+            return self._index.ids(self._index.search(query))
+
+    def search_traces(self, query: str, limit: Optional[int] = None) -> List[RunSerializable]:
+        """ the latest `limit` traces matching the query """
+        with self._lock:
+            self._catch_up()
+            docs = self._index.search(query)
+        docs = docs if limit is None else docs[-limit:] if limit else []
+        return [trace for doc in docs for trace in self._component.get_trace(offset=doc, limit=1)]
+
+    def close(self) -> None:
+        self._component.save()
+        self._component.close()
+        with self._lock:
+            self._index.close()
+
+
+def find_search_index(log: TraceLogBase) -> Optional[TraceSearchIndexLog]:
+    """ the TraceSearchIndexLog among the decorators of log, e.g. under a TraceBackgroundSavingLog """
+    while log is not None:
+        if isinstance(log, TraceSearchIndexLog):
+            return log
+        log = getattr(log, "_component", None)
+    return None
@@ -0,0 +1,218 @@
+import os
+import gzip
+import json
+import threading
+from collections import OrderedDict
+from typing import Union, Dict, List, Any, Optional
+from langchain_core.tracers.schemas import Run
+
+from research_helper.schemas.run import RunSerializable
+from research_helper.tracer.trace_log import TraceLogBase
+from research_helper.tracer.jsonl_trace_log import repair_tail, broken_record
+from research_helper.tracer.run_codec import RunCodec
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS = {
+    "gzip": (".gz", lambda data: gzip.compress(data), lambda data: gzip.decompress(data)),
+}
+if zstandard is not None:
+    COMPRESSIONS["zstd"] = (
+        ".zst",
+        lambda data: zstandard.ZstdCompressor().compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+
+class TraceSegmentedLog(TraceLogBase):
+    """
+        jsonl log split into segments under a directory
+
+        the active segment is appended to until it reaches `max_bytes` or `max_runs`,
+        then it is sealed into a compressed file and a new segment starts.
+        sealed segments are decompressed only when their traces are accessed.
+
+        the segments and the manifest are owned by a single writer, unlike TraceLazyLog(shared=True)
+        it does not pick up traces appended by other sessions, so it is not used for the shared chat.log.
+    """
+    MANIFEST_FILE = "segments.json"
+
+    def __init__(
+        self, dir_path: str,
+        max_bytes: int = 8 << 20, max_runs: int = 1000,
+        compression: Optional[str] = None, cache_segments: int = 2,
+        codec: Optional[RunCodec] = None,
+    ) -> None:
+        """
+        Args:
+            dir_path (str): directory of segments and their manifest
+            max_bytes (int): seal the active segment once it is this large
+            max_runs (int): seal the active segment once it has this many traces
+            compression (Optional[str]): "gzip" or "zstd", zstd if it is installed by default
+            cache_segments (int): number of decompressed sealed segments kept in memory
+        """
+        if compression is None:
+            compression = "zstd" if "zstd" in COMPRESSIONS else "gzip"
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Invalid compression: {compression}, must be one of {list(COMPRESSIONS)}")
+
+        self._dir_path = dir_path if not dir_path.endswith("/") else dir_path[:-1]
+        if not os.path.isdir(self._dir_path):
+            os.makedirs(self._dir_path)
+
+        self._max_bytes = max_bytes
+        self._max_runs = max_runs
+        self._compression = compression
+        self._cache_segments = cache_segments
+        self._codec = codec or RunCodec()
+        self._lock = threading.RLock()
+
+        self._sealed: List[Dict[str, Any]] = self._load_manifest() # [{"file": ..., "count": ...}]
+        self._active: List[bytes] = [] # lines of the active segment
+        self._active_bytes = 0
+        self._unsaved: List[RunSerializable] = []
+        self._segment_cache: "OrderedDict[str, List[bytes]]" = OrderedDict()
+        self._load_active()
+
+    def add_trace(self, run: Run) -> Union[RunSerializable, None]:
+        if not self._is_trace(run):
+            return None
+        added_run = run if isinstance(run, RunSerializable) else RunSerializable.from_run(run)
+        with self._lock:
+            self._unsaved.append(added_run)
+        return added_run
+
+    def _is_trace(self, run: Run):
+        return run.parent_run_id is None
+
+    def get_trace(self, offset: int = 0, limit: Optional[int] = None) -> List[RunSerializable]:
+        with self._lock:
+            stop = self.count() if limit is None else min(offset+limit, self.count())
+            traces = []
+            start = 0 # index of the first trace of the current segment
+            for segment in [*self._sealed, None]:
+                lines = self._active if segment is None else None
+                size = len(lines) if segment is None else segment["count"]
+                if start+size > offset and start < stop:
+                    if lines is None:
+                        lines = self._read_sealed(segment["file"])
+                    segment_file = self._active_path if segment is None else self._dir_path+"/"+segment["file"]
+                    for index in range(max(offset-start, 0), min(stop-start, size)):
+                        try:
+                            traces.append(self._codec.loads(lines[index]))
+                        except Exception as e:
+                            traces.append(broken_record(segment_file, index, e)) # keeps pages in line with count()
+                start += size
+
+            traces.extend(self._unsaved[max(offset-start, 0):max(stop-start, 0)])
+            return traces
+
+    def count(self) -> int:
+        return sum(segment["count"] for segment in self._sealed)+len(self._active)+len(self._unsaved)
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._unsaved: return
+
+            lines = [self._codec.dumps(run).encode("utf-8") for run in self._unsaved]
+            with open(self._active_path, mode="ab") as segment_file:
+                segment_file.write(b"".join(lines))
+            self._active.extend(lines)
+            self._active_bytes += sum(len(line) for line in lines)
+            self._unsaved = []
+
+            if self._active_bytes >= self._max_bytes or len(self._active) >= self._max_runs:
+                self._seal()
+
+    def _seal(self) -> None:
+        extension, compress, _ = COMPRESSIONS[self._compression]
+        active_path = self._active_path
+        sealed_file = self._segment_name(len(self._sealed))+extension
+        sealed_path = self._dir_path+"/"+sealed_file
+
+        with open(sealed_path+".tmp", mode="wb") as segment_file:
+            segment_file.write(compress(b"".join(self._active)))
+        os.replace(sealed_path+".tmp", sealed_path)
+
+        # the manifest is the commit point, the active segment is removed only after it
+        self._sealed.append({"file": sealed_file, "count": len(self._active)})
+        self._save_manifest()
+        os.remove(active_path)
+
+        self._active = []
+        self._active_bytes = 0
+
+    def _read_sealed(self, sealed_file: str) -> List[bytes]:
+        if sealed_file in self._segment_cache:
+            self._segment_cache.move_to_end(sealed_file)
+            return self._segment_cache[sealed_file]
+
+        _, extension = os.path.splitext(sealed_file)
+        decompress = next(decompress for ext, _, decompress in COMPRESSIONS.values() if ext == extension)
+        with open(self._dir_path+"/"+sealed_file, mode="rb") as segment_file:
+            lines = [line for line in decompress(segment_file.read()).splitlines(keepends=True) if line.strip()]
+
+        self._segment_cache[sealed_file] = lines
+        while len(self._segment_cache) > self._cache_segments:
+            self._segment_cache.popitem(last=False)
+        return lines
+
+    def _load_manifest(self) -> List[Dict[str, Any]]:
+        try:
+            with open(self._dir_path+"/"+TraceSegmentedLog.MANIFEST_FILE, mode="r", encoding="utf-8") as manifest_file:
+                return json.load(manifest_file)["segments"]
+        except:
+            return []
+
+    def _save_manifest(self) -> None:
+        manifest_path = self._dir_path+"/"+TraceSegmentedLog.MANIFEST_FILE
+        with open(manifest_path+".tmp", mode="w", encoding="utf-8") as manifest_file:
+            json.dump({"segments": self._sealed}, manifest_file)
+        os.replace(manifest_path+".tmp", manifest_path)
+
+    def _load_active(self) -> None:
+        # recover from a crash while sealing
+        # a sealed file which never made it into the manifest is rebuilt from the active segment
+        for ext, _, _ in COMPRESSIONS.values():
+            orphan_path = self._dir_path+"/"+self._segment_name(len(self._sealed))+ext
+            if os.path.exists(orphan_path):
+                os.remove(orphan_path)
+        # and an active segment which was already sealed is dropped
+        if self._sealed and os.path.exists(leftover_path := self._dir_path+"/"+self._segment_name(len(self._sealed)-1)):
+            os.remove(leftover_path)
+
+        try:
+            with open(self._active_path, mode="rb") as segment_file:
+                data = segment_file.read()
+        except FileNotFoundError:
+            return
+
+        self._active = [line for line in data.splitlines(keepends=True) if line.strip()]
+        if not self._active or self._active[-1].endswith(b"\n"):
+            self._active_bytes = len(data)
+            return
+
+        # only the last line can be partially written
+        tail = self._active.pop()
+        valid_end = len(data)-len(tail)
+        try:
+            self._codec.loads(tail)
+            self._active.append(tail+b"\n")
+            valid_end = len(data)
+        except:
+            """ truncated while writing, drop it """
+        repair_tail(self._active_path, valid_end)
+        self._active_bytes = sum(len(line) for line in self._active)
+
+    def _segment_name(self, segment_id: int) -> str:
+        return f"segment-{segment_id:06d}.jsonl"
+
+    @property
+    def _active_path(self) -> str:
+        return self._dir_path+"/"+self._segment_name(len(self._sealed))
+
+    @property
+    def _serialized(self) -> str:
+        return "".join(self._codec.dumps(run) for run in self.get_trace())
@@ -0,0 +1,167 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Union, Dict, List, Any, Optional, Tuple
+from langchain_core.tracers.schemas import Run
+
+from research_helper.schemas.run import RunSerializable
+from research_helper.schemas.trace import TraceListSerializable
+from research_helper.tracer.trace_log import TraceLogBase
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    seq           INTEGER PRIMARY KEY AUTOINCREMENT,
+    id            TEXT NOT NULL UNIQUE,
+    root_id       TEXT NOT NULL,
+    parent_run_id TEXT,
+    position      INTEGER NOT NULL,
+    trace_id      TEXT,
+    name          TEXT NOT NULL,
+    run_type      TEXT NOT NULL,
+    start_time    REAL NOT NULL,
+    end_time      REAL,
+    error         TEXT,
+    data          TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_parent_idx     ON runs(parent_run_id, position);
+CREATE INDEX IF NOT EXISTS runs_root_idx       ON runs(root_id);
+CREATE INDEX IF NOT EXISTS runs_trace_id_idx   ON runs(trace_id);
+CREATE INDEX IF NOT EXISTS runs_start_time_idx ON runs(start_time);
+CREATE INDEX IF NOT EXISTS runs_name_idx       ON runs(name);
+
+CREATE TABLE IF NOT EXISTS tags (
+    run_id TEXT NOT NULL,
+    tag    TEXT NOT NULL,
+    PRIMARY KEY (run_id, tag)
+);
+CREATE INDEX IF NOT EXISTS tags_tag_idx ON tags(tag, run_id);
+"""
+
+def _timestamp(time: Optional[datetime]) -> Optional[float]:
+    return time.timestamp() if time is not None else None
+
+class TraceSqliteLog(TraceLogBase):
+    """
+        trace log stored in sqlite
+
+        every node of a run tree is a row of `runs` keyed by its parent, so pages of traces
+        can be fetched and filtered without holding the whole log in memory.
+    """
+
+    # where-clause builders for the keys accepted by get_trace(where=...)
+    FILTERS = {
+        "id"        : lambda value: ("id = ?", [str(value)]),
+        "trace_id"  : lambda value: ("trace_id = ?", [str(value)]),
+        "name"      : lambda value: ("name = ?", [value]),
+        "run_type"  : lambda value: ("run_type = ?", [value]),
+        "tag"       : lambda value: ("id IN (SELECT run_id FROM tags WHERE tag = ?)", [value]),
+        "error"     : lambda value: ("error IS NOT NULL" if value else "error IS NULL", []),
+        "start_time": lambda value: ("start_time BETWEEN ? AND ?", [
+            _timestamp(value[0]) if value[0] is not None else float("-inf"),
+            _timestamp(value[1]) if value[1] is not None else float("inf"),
+        ]),
+    }
+
+    def __init__(self, file_path: str) -> None:
+        self._file_path = file_path
+        self._lock = threading.RLock()
+        # streamlit reruns a script on different threads
+        self._connection = sqlite3.connect(file_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        self._connection.commit()
+
+    def add_trace(self, run: Run) -> Union[RunSerializable, None]:
+        if not self._is_trace(run):
+            return None
+
+        trace = run if isinstance(run, RunSerializable) else RunSerializable.from_run(run)
+        rows, tags = [], []
+        nodes: List[Tuple[RunSerializable, Optional[str], int]] = [(trace, None, 0)]
+        while nodes:
+            node, parent_id, position = nodes.pop()
+            rows.append((
+                str(node.id), str(trace.id), parent_id, position,
+                str(node.trace_id) if node.trace_id else None,
+                node.name, node.run_type,
+                _timestamp(node.start_time), _timestamp(node.end_time), node.error,
+                node.model_dump_json(exclude={"child_runs"}),
+            ))
+            tags.extend((str(node.id), tag) for tag in node.tags or [])
+            nodes.extend((child, str(node.id), idx) for idx, child in enumerate(node.child_runs))
+
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO runs (id, root_id, parent_run_id, position, trace_id, name, run_type, start_time, end_time, error, data)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._connection.executemany("INSERT OR IGNORE INTO tags (run_id, tag) VALUES (?, ?)", tags)
+        return trace
+
+    def _is_trace(self, run: Run):
+        return run.parent_run_id is None
+
+    def get_trace(self, offset: int = 0, limit: Optional[int] = None, where: Optional[Dict[str, Any]] = None) -> List[RunSerializable]:
+        """
+        Args:
+            offset (int): number of matched traces to skip
+            limit (Optional[int]): max number of traces to return, all if None
+            where (Optional[Dict[str, Any]]): conditions on root runs joined with AND.
+                keys are "id", "trace_id", "name", "run_type", "tag", "error" (bool)
+                and "start_time" ((since, until) where either side may be None)
+        """
+        clause, params = self._where(where)
+        with self._lock:
+            root_ids = [row[0] for row in self._connection.execute(
+                f"SELECT id FROM runs WHERE {clause} ORDER BY seq LIMIT ? OFFSET ?",
+                [*params, limit if limit is not None else -1, offset]
+            )]
+            if not root_ids:
+                return []
+            placeholders = ",".join("?"*len(root_ids))
+            rows = self._connection.execute(
+                f"SELECT id, parent_run_id, data FROM runs WHERE root_id IN ({placeholders}) ORDER BY parent_run_id, position",
+                root_ids
+            ).fetchall()
+
+        nodes: Dict[str, RunSerializable] = {}
+        children: Dict[str, List[RunSerializable]] = {}
+        for run_id, parent_id, data in rows:
+            node = RunSerializable(**json.loads(data))
+            nodes[run_id] = node
+            if parent_id is not None:
+                children.setdefault(parent_id, []).append(node)
+        for run_id, node in nodes.items():
+            node.child_runs = children.get(run_id, [])
+
+        return [nodes[root_id] for root_id in root_ids]
+
+    def count(self, where: Optional[Dict[str, Any]] = None) -> int:
+        clause, params = self._where(where)
+        with self._lock:
+            return self._connection.execute(f"SELECT COUNT(*) FROM runs WHERE {clause}", params).fetchone()[0]
+
+    def _where(self, where: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+        clauses, params = ["parent_run_id IS NULL"], []
+        for key, value in (where or {}).items():
+            if key not in TraceSqliteLog.FILTERS:
+                raise ValueError(f"Invalid filter: {key}, must be one of {list(TraceSqliteLog.FILTERS)}")
+            clause, param = TraceSqliteLog.FILTERS[key](value)
+            clauses.append(clause)
+            params.extend(param)
+        return " AND ".join(clauses), params
+
+    def save(self) -> None:
+        with self._lock:
+            self._connection.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    @property
+    def _serialized(self) -> str:
+        return TraceListSerializable(traces=self.get_trace()).model_dump_json(indent=2)
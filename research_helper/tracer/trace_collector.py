@@ -1,26 +1,73 @@
-from typing import Any
+import json
+import random
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+import xxhash
 from langchain_core.tracers import BaseTracer
 from langchain_core.tracers.schemas import Run
 
 from research_helper.tracer.trace_log import TraceLogBase
+from research_helper.tracer.run_filter import RunFilter, RunFilterPipeline
 
-REDANDANT_EVENTS = [
-    "new_token",
-]
+SAMPLE_BY = ["random", "input"]
 
 class TraceCollectorCallbackHandler(BaseTracer):
-    def __init__(self, log: TraceLogBase, **kwargs: Any):
+    def __init__(
+        self, log: TraceLogBase,
+        sample_rate: float = 1.0, sample_by: str = "random", slow_threshold: Optional[float] = None,
+        filters: Optional[List[RunFilter]] = None,
+        **kwargs: Any
+    ):
+        """
+        Args:
+            sample_rate (float): fraction of traces which keep their child runs,
+                the others are logged with their root inputs/outputs only
+            sample_by (str): "random", or "input" to decide by a hash of the root inputs
+                so that the same input is always sampled the same way
+            slow_threshold (Optional[float]): traces taking at least this many seconds always keep their child runs,
+                as do traces with an errored run
+            filters (Optional[List[RunFilter]]): applied to every node before the trace is logged,
+                token events are counted into extra and dropped by default
+        """
         super().__init__(**kwargs)
+        if sample_by not in SAMPLE_BY:
+            raise ValueError(f"Invalid sample_by: {sample_by}, must be one of {SAMPLE_BY}")
         self._log = log
+        self._sample_rate = sample_rate
+        self._sample_by = sample_by
+        self._slow_threshold = slow_threshold
+        self._pipeline = RunFilterPipeline(filters)
+        self._sampled: Dict[UUID, bool] = {} # whether each running trace was sampled when its root started
+    
+    def _start_trace(self, run: Run) -> None:
+        super()._start_trace(run)
+        if run.parent_run_id is None:
+            self._sampled[run.id] = self._sample_rate >= 1.0 or self._sample(run) < self._sample_rate
     
     def _persist_run(self, run: Run) -> None:
+        sampled = self._sampled.pop(run.id, True)
         if run.outputs is not None: # if run finished in error, outputs should be None
-            self._log.add_trace(self._remove_redandant_events(run))
+            # child runs of a trace which is not sampled are still collected, it is kept in full if it turns out slow or errored
+            if not (sampled or self._is_slow(run) or self._has_error(run)):
+                run.child_runs = []
+            self._log.add_trace(self._pipeline.apply(run))
+    
+    def _is_slow(self, run: Run) -> bool:
+        return self._slow_threshold is not None and run.end_time is not None \
+            and (run.end_time-run.start_time).total_seconds() >= self._slow_threshold
+    
+    def _sample(self, run: Run) -> float:
+        """ uniform value in [0, 1) """
+        if self._sample_by == "input":
+            key = json.dumps(run.inputs, sort_keys=True, ensure_ascii=False, default=str)
+            return xxhash.xxh64_intdigest(key.encode("utf-8"))/2**64
+        return random.random()
     
-    def _remove_redandant_events(self, run: Run):
-        run.events = [event for event in run.events if event["name"] not in REDANDANT_EVENTS]
-        if run.child_runs:
-            for child_run in run.child_runs:
-                self._remove_redandant_events(child_run)
-        
-        return run
\ No newline at end of file
+    def _has_error(self, run: Run) -> bool:
+        runs = [run]
+        while runs:
+            node = runs.pop()
+            if node.error is not None:
+                return True
+            runs.extend(node.child_runs)
+        return False
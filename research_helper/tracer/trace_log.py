@@ -1,23 +1,42 @@
 from abc import ABC, abstractmethod
-from typing import Union, Dict, List, Any
-import json
+from typing import Union, Dict, List, Any, Optional, Deque, Tuple
+from dataclasses import dataclass, replace
+import orjson
+import time
+import queue
+import weakref
+import threading
+from collections import deque
+from itertools import islice
 from langchain_core.tracers.schemas import Run
 
 from research_helper.schemas.trace import RunSerializable, TraceListSerializable
 
+def page(traces: List[RunSerializable], offset: int = 0, limit: Optional[int] = None) -> List[RunSerializable]:
+    if offset == 0 and limit is None:
+        return traces
+    return traces[offset:] if limit is None else traces[offset:offset+limit]
+
 class TraceLogBase(ABC):
     @abstractmethod
     def add_trace(self, run: Run) -> Union[RunSerializable, None]:
         ...
     
     @abstractmethod
-    def get_trace(self) -> List[RunSerializable]:
+    def get_trace(self, offset: int = 0, limit: Optional[int] = None) -> List[RunSerializable]:
+        """ traces in the order they were added, `limit` traces from `offset` """
         ...
+    
+    def count(self) -> int:
+        return len(self.get_trace())
         
     @abstractmethod
     def save(self) -> None:
         ...
     
+    def close(self) -> None:
+        """ release resources held by the log """
+    
     @property
     @abstractmethod
     def _serialized(self) -> str:
@@ -37,8 +56,8 @@ class TraceLog(TraceLogBase):
     def _is_trace(self, run: Run):
         return run.parent_run_id is None
     
-    def get_trace(self) -> List[RunSerializable]:
-        return self._trace_list.traces
+    def get_trace(self, offset: int = 0, limit: Optional[int] = None) -> List[RunSerializable]:
+        return page(self._trace_list.traces, offset, limit)
     
     def save(self) -> None:
         with open(self._file_path, mode="w", encoding="utf-8") as log_file:
@@ -46,26 +65,34 @@ class TraceLog(TraceLogBase):
     
     def _load_log(self) -> Dict[str, Any]:
         try:
-            with open(self._file_path, mode="r", encoding="utf-8") as log_file:
-                return json.load(log_file)
+            with open(self._file_path, mode="rb") as log_file:
+                return orjson.loads(log_file.read())
         except:
             return {'traces': []}
     
     @property
     def _serialized(self) -> str:
-        return self._trace_list.model_dump_json(indent=2)
+        # no indentation, it makes both dumping and loading slower
+        return self._trace_list.model_dump_json()
 
 
 class TraceLogDecorator(TraceLogBase):
     def __init__(self, component: TraceLogBase) -> None:
         self._component = component
         
-    def get_trace(self) -> List[RunSerializable]:
-        return self._component.get_trace()
+    def get_trace(self, offset: int = 0, limit: Optional[int] = None, **kwargs) -> List[RunSerializable]:
+        """ kwargs such as the `where` of TraceSqliteLog are passed to the component """
+        return self._component.get_trace(offset, limit, **kwargs)
+    
+    def count(self, **kwargs) -> int:
+        return self._component.count(**kwargs)
     
     def save(self) -> None:
         return self._component.save()
     
+    def close(self) -> None:
+        return self._component.close()
+    
     @property
     def _serialized(self) -> str:
         return self._component._serialized
@@ -87,3 +114,283 @@ class TraceConstantSavingLog(TraceLogDecorator):
             self.save()
         
         return added_run
+
+
+@dataclass
+class WriterStats:
+    queue_depth: int = 0          # traces waiting in the queue
+    max_queue_depth: int = 0
+    blocked_puts: int = 0         # add_trace calls which had to wait for a full queue
+    flushes: int = 0
+    saved_traces: int = 0
+    errors: int = 0
+    last_error: str = ""
+    last_flush_latency: float = 0.0
+    max_flush_latency: float = 0.0
+    total_flush_latency: float = 0.0
+    
+    @property
+    def mean_flush_latency(self) -> float:
+        return self.total_flush_latency / self.flushes if self.flushes else 0.0
+
+_STOP = object()
+
+class _Barrier(threading.Event):
+    """ set by the writer once the items queued before it are applied, without saving """
+
+class _Writer:
+    """
+        writer thread of a TraceBackgroundSavingLog.
+        it holds no reference to the log, so that a log which is never closed can be collected and its thread stopped
+    """
+    
+    def __init__(self, component, lock, interval, flush_interval, max_queue_size, defer_add) -> None:
+        self.component = component
+        self.lock = lock
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.defer_add = defer_add
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.stats = WriterStats()
+        
+        self.thread = threading.Thread(target=self.run, name="trace-log-writer", daemon=True)
+        self.thread.start()
+    
+    def stop(self) -> None:
+        """ save what is queued and close the component """
+        self.queue.put(_STOP)
+        if threading.current_thread() is not self.thread: # the log may be collected on the writer thread
+            self.thread.join()
+    
+    def run(self) -> None:
+        pending = 0
+        deadline = None # time to save the oldest pending trace
+        while True:
+            timeout = None if deadline is None else max(deadline-time.monotonic(), 0)
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None # flush_interval passed
+            
+            if item is _STOP:
+                if pending: self.save(pending)
+                self.close()
+                return
+            if isinstance(item, _Barrier):
+                item.set()
+                continue
+            if isinstance(item, threading.Event):
+                if pending: self.save(pending)
+                pending, deadline = 0, None
+                item.set()
+                continue
+            
+            if item is not None:
+                if self.defer_add:
+                    self.add(item)
+                pending+=1
+                if deadline is None:
+                    deadline = time.monotonic()+self.flush_interval
+            if item is None or pending >= self.interval:
+                self.save(pending)
+                pending, deadline = 0, None
+    
+    def add(self, run: RunSerializable) -> None:
+        try:
+            with self.lock:
+                self.component.add_trace(run)
+        except Exception as e:
+            self._error(e)
+    
+    def save(self, count: int = 1) -> None:
+        start = time.perf_counter()
+        try:
+            with self.lock:
+                self.component.save()
+        except Exception as e:
+            self._error(e)
+            return
+        
+        latency = time.perf_counter()-start
+        self.stats.flushes+=1
+        self.stats.saved_traces+=count
+        self.stats.last_flush_latency = latency
+        self.stats.max_flush_latency = max(self.stats.max_flush_latency, latency)
+        self.stats.total_flush_latency+=latency
+    
+    def close(self) -> None:
+        try:
+            with self.lock:
+                self.component.close()
+        except Exception as e:
+            self._error(e)
+    
+    def _error(self, error: Exception) -> None:
+        self.stats.errors+=1
+        self.stats.last_error = str(error)
+
+class TraceBackgroundSavingLog(TraceLogDecorator):
+    """ saves on a writer thread, so add_trace never waits for disk I/O unless the queue is full """
+    
+    def __init__(self, component, interval=32, flush_interval=1.0, max_queue_size=1024, defer_add=False) -> None:
+        """
+        Args:
+            interval (int): save once this many traces are waiting
+            flush_interval (float): save at latest this many seconds after a trace was added
+            max_queue_size (int): add_trace blocks while this many traces are waiting
+            defer_add (bool): also add traces to the component on the writer thread,
+                for components which write in add_trace like a shared TraceLazyLog.
+                reads wait until the traces queued before them are added
+        """
+        super().__init__(component)
+        
+        self._defer_add = defer_add
+        self._lock = threading.RLock() # guards the component against the writer thread
+        self._state_lock = threading.Lock() # orders enqueueing against close, the writer never takes it
+        self._closed = False
+        self._writer = _Writer(component, self._lock, interval, flush_interval, max_queue_size, defer_add)
+        self._queue = self._writer.queue
+        # stops the writer when the log is closed, collected or at exit
+        self._finalizer = weakref.finalize(self, self._writer.stop)
+    
+    def add_trace(self, run: Run) -> Union[RunSerializable, None]:
+        with self._state_lock:
+            if not self._closed:
+                return self._enqueue(run)
+        
+        # closed, the writer is gone
+        with self._lock:
+            added_run = self._component.add_trace(run)
+            if added_run:
+                self._component.save()
+        return added_run
+    
+    def _enqueue(self, run: Run) -> Union[RunSerializable, None]:
+        if self._defer_add:
+            if run.parent_run_id is not None:
+                return None
+            added_run = run if isinstance(run, RunSerializable) else RunSerializable.from_run(run)
+        else:
+            with self._lock:
+                added_run = self._component.add_trace(run)
+            if not added_run:
+                return added_run
+        
+        stats = self._writer.stats
+        try:
+            self._queue.put_nowait(added_run)
+        except queue.Full:
+            stats.blocked_puts+=1
+            self._queue.put(added_run)
+        stats.max_queue_depth = max(stats.max_queue_depth, self._queue.qsize())
+        return added_run
+    
+    def get_trace(self, offset: int = 0, limit: Optional[int] = None, **kwargs) -> List[RunSerializable]:
+        self._sync()
+        with self._lock:
+            return self._component.get_trace(offset, limit, **kwargs)
+    
+    def count(self, **kwargs) -> int:
+        self._sync()
+        with self._lock:
+            return self._component.count(**kwargs)
+    
+    def _sync(self) -> None:
+        """ wait until the deferred traces queued so far are in the component """
+        if not self._defer_add: return
+        self._wait(_Barrier())
+    
+    def save(self) -> None:
+        self.flush()
+    
+    def flush(self) -> None:
+        """ block until every trace added so far is saved """
+        self._wait(threading.Event())
+    
+    def _wait(self, event: threading.Event) -> None:
+        with self._state_lock:
+            if self._closed: return
+            self._queue.put(event)
+        event.wait()
+    
+    def close(self) -> None:
+        with self._state_lock:
+            if self._closed: return
+            self._closed = True
+        self._finalizer()
+    
+    @property
+    def stats(self) -> WriterStats:
+        return replace(self._writer.stats, queue_depth=self._queue.qsize())
+
+
+class TraceWindowLog(TraceLogDecorator):
+    """
+        keeps only the latest traces in memory and leaves older ones to the component,
+        which should be disk backed like TraceLazyLog, so memory stays flat however long the log gets
+    """
+    
+    def __init__(self, component, max_traces: int = 256, max_bytes: Optional[int] = None) -> None:
+        """
+        Args:
+            max_traces (int): max number of traces in the window
+            max_bytes (Optional[int]): max size of the traces in the window as json, not bounded if None.
+                every added trace is serialized once more to measure it
+        """
+        super().__init__(component)
+        
+        self._max_traces = max_traces
+        self._max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._window: Deque[Tuple[RunSerializable, int]] = deque() # (trace, size) of the latest traces
+        self._window_bytes = 0
+        self._window_end = component.count() # offset right after the latest trace in the window
+    
+    def add_trace(self, run: Run) -> Union[RunSerializable, None]:
+        # appended under the lock, so the order of the window matches the component under concurrent callbacks
+        with self._lock:
+            added_run = self._component.add_trace(run)
+            if not added_run:
+                return added_run
+            
+            size = len(added_run.model_dump_json()) if self._max_bytes is not None else 0
+            count = self._component.count()
+            if count-1 != self._window_end:
+                # another writer appended to a shared log, the offset of the trace is not known
+                self._clear()
+                self._window_end = count
+                return added_run
+            self._window.append((added_run, size))
+            self._window_end = count
+            self._window_bytes += size
+            while len(self._window) > self._max_traces or (
+                self._max_bytes is not None and self._window_bytes > self._max_bytes and len(self._window) > 1
+            ):
+                _, evicted_size = self._window.popleft()
+                self._window_bytes -= evicted_size
+        return added_run
+    
+    def get_trace(self, offset: int = 0, limit: Optional[int] = None, **kwargs) -> List[RunSerializable]:
+        if kwargs:
+            # filtered offsets do not line up with the window
+            return self._component.get_trace(offset, limit, **kwargs)
+        with self._lock:
+            count = self.count()
+            stop = count if limit is None else min(offset+limit, count)
+            window_start = self._window_end-len(self._window) # offset of the oldest trace in memory
+            
+            traces = []
+            if offset < window_start:
+                # fault older traces in from the component
+                traces = self._component.get_trace(offset, min(stop, window_start)-offset)
+            traces.extend(
+                run for run, _ in islice(self._window, max(offset-window_start, 0), max(min(stop, self._window_end)-window_start, 0))
+            )
+            if stop > self._window_end:
+                # traces appended by other writers of a shared log
+                traces.extend(self._component.get_trace(max(offset, self._window_end), stop-max(offset, self._window_end)))
+            return traces
+    
+    def _clear(self) -> None:
+        self._window.clear()
+        self._window_bytes = 0
@@ -1,3 +1,6 @@
+import io
+import time
+import threading
 from typing import Any, Optional, Coroutine, Dict
 from uuid import UUID
 from langchain_core.tracers.base import BaseTracer
@@ -21,15 +24,55 @@ class UICallbackHandler(BaseTracer):
         
 
 class UIStreamingCallbackHandler(UICallbackHandler):
-    """ Copied only streaming part from StreamlitCallbackHandler """
+    """
+        Copied only streaming part from StreamlitCallbackHandler
+
+        tokens are buffered and written to the view at most every `flush_interval` seconds or `flush_tokens` tokens,
+        each write re-renders the whole text, so a long response costs dozens of renders instead of thousands
+    """
     
-    def __init__(self, name: str, view: InteractiveRunViewBase, **kwargs) -> None:
-        super().__init__(**kwargs)
+    def __init__(
+        self, name: str, view: InteractiveRunViewBase,
+        flush_interval: float = 0.1, flush_tokens: int = 64, **kwargs,
+    ) -> None:
+        """
+        Args:
+            flush_interval (float): seconds between writes to the view
+            flush_tokens (int): tokens buffered before a write regardless of the interval
+        """
+        super().__init__(view=view, **kwargs)
         self.name = name
-        self._view = view
-        self._tokens_stream = ""
+        self._flush_interval = flush_interval
+        self._flush_tokens = flush_tokens
+        self._tokens_stream = io.StringIO()
+        self._pending = 0 # tokens not written to the view yet
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
     
     def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
         """ Run on new LLM token. Only available when streaming is enabled. """
-        self._tokens_stream += token
-        self._view.write({self.name: self._tokens_stream})
+        with self._lock:
+            self._tokens_stream.write(token)
+            self._pending += 1
+            if self._pending >= self._flush_tokens or time.monotonic()-self._last_flush >= self._flush_interval:
+                self._flush()
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._view.write({self.name: self._tokens_stream.getvalue()})
+
+    def flush(self) -> None:
+        """ write the buffered tokens to the view """
+        with self._lock:
+            self._flush()
+
+    def on_llm_end(self, *args: Any, **kwargs: Any) -> Run:
+        self.flush()
+        return super().on_llm_end(*args, **kwargs)
+
+    def on_llm_error(self, *args: Any, **kwargs: Any) -> Run:
+        self.flush()
+        return super().on_llm_error(*args, **kwargs)
@@ -1,7 +1,5 @@
-import os
 import sys
 import streamlit as st
-import importlib
 import inspect
 import time
 from typing import Union, List
@@ -11,20 +9,11 @@ from langchain_core.runnables import Runnable
 from langchain_core import runnables
 
 from research_helper.ui.components.base import ComponentBase
+from research_helper.models.loader import load_model_cls
 
 MODEL_FILE_NAME = "user_model.py"
 BUILT_IN_RUNNABLES = [runnable[1] for runnable in inspect.getmembers(runnables, inspect.isclass) if issubclass(runnable[1], Runnable)]
 
-class ModelNotFoundError(Exception):
-    pass
-
-def path2module_name(path: str):
-    if path.startswith(("/", "./")):
-        path = path.split("/", maxsplit=1)[-1] # remove "./" or "/" e.x.) ./a/b/c.py -> a/b/c.py
-    module_name, ext = os.path.splitext(path)  # e.x.) a/b/c.py -> a/b/c
-    module_name = module_name.replace("/", ".")       # e.x.) a/b/c -> a.b.c
-    return module_name
-
 class ModelUploader(ComponentBase):
     def __init__(self, dir_path: str) -> None:
         super().__init__(dir_path+"-uploader")
@@ -57,38 +46,7 @@ class ModelUploader(ComponentBase):
         self._error = None
     
     def _load_model_cls(self, model_path: str) -> type:
-        # prepare module path
-        module_name = path2module_name(model_path)
-        
-        # import
-        module = importlib.import_module(module_name)
-        module = importlib.reload(module)
-        user_runnables = [
-            {
-                "cls"    : cls_info[1],
-                "parents": cls_info[1].__mro__
-            }
-            for cls_info in inspect.getmembers(module, inspect.isclass)
-            if issubclass(cls_info[1], Runnable)
-        ]
-        
-        if user_runnables:
-            # 継承が深い順にソート
-            sorted_runnables = sorted(user_runnables, key=lambda cls_info: len(cls_info["parents"]), reverse=True)
-            
-            for user_runnable in user_runnables:
-                model_cls: Runnable = user_runnable["cls"]
-                if model_cls.name == "entry_point":
-                    # もし "entry_point" という名前の ruunable があれば、それを model とする。
-                    return model_cls, model_cls()
-            
-            # otherwise
-            # ユーザが定義した runnable のうち継承が最も深いものを model とする。
-            # 例えば research_helper.models.Model を 継承した SubModel があった場合 SubModel が対象となる
-            model_cls = sorted_runnables[0]["cls"]
-            return model_cls, model_cls()
-        
-        raise ModelNotFoundError("You need to define your model extending langchain_core.runnables.Runnable")
+        return load_model_cls(model_path)
     
     def _upload(self, uploaded_file: UploadedFile) -> None:
         self._reset_field()
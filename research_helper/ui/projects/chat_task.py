@@ -1,7 +1,9 @@
+import os
 import sys
 import json
 import traceback
 import streamlit as st
+import pandas as pd
 from typing import Dict, Optional, List
 from dataclasses import dataclass
 
@@ -9,19 +11,45 @@ from research_helper.ui.projects.task_base import Task, TaskConfigComponent
 from research_helper.ui.components import AddingList, RowComponentFactory, TextInput, ModelUploader
 from research_helper.ui.views import ChatView, TableView
 from research_helper.ui.views.observer import Request, OnserverBase
-from research_helper.ui.views.requests import RUN_MODEL_REQUEST
+from research_helper.ui.views.requests import RUN_MODEL_REQUEST, RUN_BATCH_REQUEST
 
 from research_helper.models import Model
-from research_helper.tracer.trace_log import TraceLog, TraceConstantSavingLog
+from research_helper.models.cached_model import CachedModel, CACHE_MODES
+from research_helper.models.response_cache import ResponseCache
+from research_helper.models.batch import batch_as_completed
+from research_helper.models.async_runner import Job, get_runner
+from research_helper.models.process_pool import ProcessModelPool
+from research_helper.models.rate_limiter import RateLimiter, RateLimitedModel
+from research_helper.dataframe.parquet_export import export_parquet
+from research_helper.tracer.trace_log import TraceWindowLog, TraceBackgroundSavingLog
+from research_helper.tracer.jsonl_trace_log import TraceLazyLog
+from research_helper.tracer.run_codec import BlobRunCodec
+from research_helper.tracer.blob_store import BlobStore
+from research_helper.tracer.search_index import TraceSearchIndexLog
+from research_helper.tracer.binary_trace_log import convert_log
 from research_helper.tracer.trace_collector import TraceCollectorCallbackHandler
 from research_helper.tracer.ui_stramer import UICallbackHandler
 
 
 CHAT_LOG_FILE = "chat.log"
+PARQUET_FILE = "chat.parquet"
+SNAPSHOT_FILE = "chat.bin"
+BLOB_DIR = "blobs"
+INDEX_FILE = "chat.index"
+CACHE_FILE = "responses.db"
+WINDOW_TRACES = 256
+EXECUTION_MODES = ["thread", "process"]
 @dataclass
 class ChatConfig:
     args: List[str]
     model: Model
+    cache_mode: str
+    max_concurrency: int
+    execution: str
+    max_rps: float
+    max_tpm: int
+    sample_rate: float
+    slow_threshold: float
     config: Dict
 
 class ChatConfigPanel(TaskConfigComponent):
@@ -43,6 +71,70 @@ class ChatConfigPanel(TaskConfigComponent):
             self._config["args"] = self.arg_list.draw()
         with right_col:
             self.model_uploader.draw()
+            st.selectbox(
+                "Response cache",
+                options=CACHE_MODES,
+                index=CACHE_MODES.index(self._config["cache"]),
+                key="chat-cache-mode",
+                help="record: reuse outputs of the model and its LLM calls for the same input. replay: fail instead of calling an LLM",
+                on_change=lambda: self._update_config("cache", st.session_state["chat-cache-mode"]),
+            )
+            st.number_input(
+                "Max concurrency",
+                min_value=1,
+                value=self._config["max_concurrency"],
+                key="chat-max-concurrency",
+                help="number of inputs of a submitted file which are run at once, or of worker processes",
+                on_change=lambda: self._update_config("max_concurrency", st.session_state["chat-max-concurrency"]),
+            )
+            st.selectbox(
+                "Execution",
+                options=EXECUTION_MODES,
+                index=EXECUTION_MODES.index(self._config["execution"]),
+                key="chat-execution",
+                help="thread: run in the server process. process: load the model into worker processes, for CPU-bound models",
+                on_change=lambda: self._update_config("execution", st.session_state["chat-execution"]),
+            )
+            rps_col, tpm_col = st.columns(2)
+            with rps_col:
+                st.number_input(
+                    "Requests per second",
+                    min_value=0.0,
+                    value=float(self._config["max_rps"]),
+                    key="chat-max-rps",
+                    help="upper limit of model calls per second, lowered automatically while the backend throttles. 0 for no limit",
+                    on_change=lambda: self._update_config("max_rps", st.session_state["chat-max-rps"]),
+                )
+            with tpm_col:
+                st.number_input(
+                    "Tokens per minute",
+                    min_value=0,
+                    value=self._config["max_tpm"],
+                    key="chat-max-tpm",
+                    help="limit of LLM tokens per minute, as reported by the LLMs. 0 for no limit",
+                    on_change=lambda: self._update_config("max_tpm", st.session_state["chat-max-tpm"]),
+                )
+            sample_col, slow_col = st.columns(2)
+            with sample_col:
+                st.number_input(
+                    "Trace sample rate",
+                    min_value=0.0,
+                    max_value=1.0,
+                    step=0.05,
+                    value=float(self._config["sample_rate"]),
+                    key="chat-sample-rate",
+                    help="fraction of traces logged with their child runs, the others keep the inputs/outputs of the chain only",
+                    on_change=lambda: self._update_config("sample_rate", st.session_state["chat-sample-rate"]),
+                )
+            with slow_col:
+                st.number_input(
+                    "Slow trace seconds",
+                    min_value=0.0,
+                    value=float(self._config["slow_threshold"]),
+                    key="chat-slow-threshold",
+                    help="traces taking at least this long are logged with their child runs regardless of the sample rate, as are traces with an error. 0 for none",
+                    on_change=lambda: self._update_config("slow_threshold", st.session_state["chat-slow-threshold"]),
+                )
             
     
     def _load_config(self) -> Dict:
@@ -50,6 +142,20 @@ class ChatConfigPanel(TaskConfigComponent):
         config["task_type"] = "chat"
         if "args" not in config:
             config["args"] = ["input"] # set `input` as default arg_list 
+        if "cache" not in config:
+            config["cache"] = "off"
+        if "max_concurrency" not in config:
+            config["max_concurrency"] = 8
+        if "execution" not in config:
+            config["execution"] = "thread"
+        if "max_rps" not in config:
+            config["max_rps"] = 0.0
+        if "max_tpm" not in config:
+            config["max_tpm"] = 0
+        if "sample_rate" not in config:
+            config["sample_rate"] = 1.0
+        if "slow_threshold" not in config:
+            config["slow_threshold"] = 0.0
         return config
     
     @property
@@ -59,18 +165,28 @@ class ChatConfigPanel(TaskConfigComponent):
         return ChatConfig(
             args=args,
             model=model,
+            cache_mode=self._config["cache"],
+            max_concurrency=self._config["max_concurrency"],
+            execution=self._config["execution"],
+            max_rps=self._config["max_rps"],
+            max_tpm=self._config["max_tpm"],
+            sample_rate=self._config["sample_rate"],
+            slow_threshold=self._config["slow_threshold"],
             config=self._config
         )
 
 class ChatInputObserver(OnserverBase):
-    _targets = [RUN_MODEL_REQUEST]
+    _targets = [RUN_MODEL_REQUEST, RUN_BATCH_REQUEST]
     
     def __init__(self, chat_task: "ChatTask") -> None:
         super().__init__()
         self.chat_task = chat_task
     
     def _process(self, request: Request):
-        self.chat_task.run(request["value"])
+        if request["name"] == RUN_BATCH_REQUEST:
+            self.chat_task.run_batch(request["value"])
+        else:
+            self.chat_task.run(request["value"])
 
 class ChatTask(Task):
     task_type: str = "chat-task"
@@ -78,18 +194,27 @@ class ChatTask(Task):
     def __init__(self, project_id: str, task_id: str=None) -> None:
         super().__init__(project_id, task_id)
         
-        self._chat_log =TraceConstantSavingLog(TraceLog(self.task_path+"/"+CHAT_LOG_FILE))
+        # recent traces stay in memory, older ones are read back from chat.log on demand.
+        # the log is shared with other sessions of the task, each trace is appended as it is added.
+        # appending and indexing run on the writer thread, the search index catches up with the log on the first search
+        self._codec = BlobRunCodec(BlobStore(self.task_path+"/"+BLOB_DIR))
+        self._chat_log = TraceBackgroundSavingLog(TraceSearchIndexLog(TraceWindowLog(TraceLazyLog(
+            self.task_path+"/"+CHAT_LOG_FILE,
+            cache_size=32,
+            codec=self._codec,
+            shared=True,
+        ), max_traces=WINDOW_TRACES), index_path=self.task_path+"/"+INDEX_FILE), defer_add=True)
         
+        self._response_cache = ResponseCache(self.task_path+"/"+CACHE_FILE)
+        self._process_pool: Optional[ProcessModelPool] = None
+        self._process_pool_key = None # what the workers were started with
+        self._rate_limiter: Optional[RateLimiter] = None
+        self._rate_limiter_key = None
         self._config = ChatConfigPanel(task_path=self.task_path)
-        self.chat_view  = ChatView([], trace_log=self._chat_log, observers=[ChatInputObserver(self)])
-        self.table_view = TableView(trace_log=self._chat_log)
-        
-        self.running_config = {
-            "callbacks": [
-                TraceCollectorCallbackHandler(log=self._chat_log),
-                UICallbackHandler(view=self.chat_view),
-            ]
-        }
+        self.chat_view  = ChatView([], trace_log=self._chat_log, observers=[ChatInputObserver(self)], run_async=True)
+        self.table_view = TableView(trace_log=self._chat_log, max_rows=WINDOW_TRACES)
+        self._download: Optional[pd.DataFrame] = None # every trace for the downloads once the table is truncated
+        self._profile_latency = False # the latency profile is built from the whole log once requested
     
     def draw(self) -> None:        
         config_tab, chat_tab, table_tab = st.tabs(["Config", "Chat", "Table"])
@@ -101,9 +226,18 @@ class ChatTask(Task):
                 self.chat_view.set_input_fields(input_fields=input_keys)
             
             self.chat_view.draw()
+            if self._rate_limiter:
+                with st.expander("Rate limiter"):
+                    st.json(self._rate_limiter.snapshot())
         with table_tab:
             self.table_view.draw()
-            if (df := self.table_view.selected) is not None:
+            df = self.table_view.selected
+            if self.table_view.truncated:
+                # the table holds only the latest traces, downloads are built from the whole log on request
+                st.caption(f"The table shows the latest {self.table_view.max_rows} traces. Downloads contain every trace of the log.")
+                st.button("Prepare download", help="read every trace of the log for the downloads", on_click=self._prepare_download)
+                df = self._download
+            if df is not None:
                 data_csv = df.to_csv(index=False).encode("utf-8")
                 data_jsonl = df.to_json(orient='records', lines=True, force_ascii=False)
             else:
@@ -121,15 +255,130 @@ class ChatTask(Task):
                 file_name=f"{self.config.config['name']}.jsonl",
                 mime="application/json",
             )
+            st.button("Export as Parquet", help=f"write all traces into {self.parquet_path}", on_click=self.export_parquet)
+            st.button("Export as snapshot", help=f"write all traces into {self.snapshot_path}, a read-only binary log for analysis", on_click=self.export_snapshot)
+            
+            with st.expander("Latency"):
+                # the profile covers the whole log, which is read once on request and then only for new traces
+                if not self._profile_latency:
+                    st.button("Profile every trace", help="read every trace of the log once, later traces are added as they come", on_click=self._start_profile)
+                else:
+                    latency = self.table_view.latency
+                    st.dataframe(latency.to_dataframe(), hide_index=True)
+                    st.download_button(
+                        label="Download as collapsed stacks",
+                        data=latency.collapsed_stacks(),
+                        file_name=f"{self.config.config['name']}.folded",
+                        mime="text/plain",
+                        help="for flamegraph tools such as flamegraph.pl or speedscope",
+                    )
+    
+    def _prepare_download(self):
+        self._download = self.table_view.export()
+    
+    def _start_profile(self):
+        self._profile_latency = True
+    
+    def export_parquet(self):
+        export_parquet(self._chat_log, self.parquet_path)
+    
+    @property
+    def parquet_path(self) -> str:
+        return self.task_path+"/"+PARQUET_FILE
+    
+    def export_snapshot(self):
+        # payloads keep their references into the blob store of the task
+        convert_log(self._chat_log, self.snapshot_path, codec=self._codec).close()
+    
+    @property
+    def snapshot_path(self) -> str:
+        return self.task_path+"/"+SNAPSHOT_FILE
+    
+    @property
+    def running_config(self) -> Dict:
+        # models run off the script thread, which is the only one that can draw,
+        # so outputs are written into the job and drawn by the chat view, and results of a batch by run_batch
+        return {
+            "callbacks": [TraceCollectorCallbackHandler(log=self._chat_log, **self._collector_kwargs)],
+        }
+    
+    @property
+    def _collector_kwargs(self) -> Dict:
+        return {
+            "sample_rate": self.config.sample_rate,
+            "slow_threshold": self.config.slow_threshold or None,
+        }
     
     def run(self, input):
-        if not self.config.model:
+        if self.config.execution == "process":
+            if pool := self._pool():
+                self.chat_view.watch(pool.submit(Job(input)))
+            return
+        if not (model := self._model()):
             return
-        try:
-            self.config.model.invoke(input, config=self.running_config)
-        except:
-            # show error in callback
-            pass
+        # the loop thread of the process runs the model, the script thread returns at once
+        job = Job(input)
+        running_config = self.running_config
+        config = {**running_config, "callbacks": [*running_config["callbacks"], UICallbackHandler(view=job)]}
+        self.chat_view.watch(get_runner().submit(job, model, config=config))
+    
+    def run_batch(self, inputs: List[Dict]):
+        if self.config.execution == "process":
+            if not (pool := self._pool()):
+                return
+            results = pool.as_completed(inputs)
+        else:
+            if not (model := self._model()):
+                return
+            results = batch_as_completed(model, inputs, config=self.running_config, max_concurrency=self.config.max_concurrency)
+        for result, progress in results:
+            self.chat_view.write_result(result, progress)
+        self.chat_view.update() # next input in the queue
+    
+    def _model(self):
+        model = self.config.model
+        if model and (limiter := self._limiter()):
+            model = RateLimitedModel(model, limiter)
+        # outermost, so that cached outputs do not use up the rate
+        if model and self.config.cache_mode != "off":
+            model = CachedModel(model, self._response_cache, replay=self.config.cache_mode == "replay")
+        return model
+    
+    def _limiter(self) -> Optional[RateLimiter]:
+        """ kept across runs so that the adapted rate and the metrics carry over, renewed when the limits change """
+        key = (self.config.max_rps, self.config.max_tpm, self.config.max_concurrency)
+        if key != self._rate_limiter_key:
+            self._rate_limiter = RateLimiter(
+                max_rps=self.config.max_rps or None,
+                max_tpm=self.config.max_tpm or None,
+                max_in_flight=self.config.max_concurrency,
+            ) if self.config.max_rps or self.config.max_tpm else None
+            self._rate_limiter_key = key
+        return self._rate_limiter
+    
+    def _pool(self) -> Optional[ProcessModelPool]:
+        """ workers loaded with the uploaded model, restarted when the model or the config changes """
+        model_path = self._config.model_uploader.model_path
+        if not self.config.model or not os.path.exists(model_path):
+            return None
+        key = (os.path.getmtime(model_path), self.config.max_concurrency, self.config.cache_mode, tuple(self._collector_kwargs.items()))
+        if key != self._process_pool_key:
+            if self._process_pool:
+                self._process_pool.close()
+            self._process_pool = ProcessModelPool(
+                model_path, self._chat_log, workers=self.config.max_concurrency,
+                cache_path=self.task_path+"/"+CACHE_FILE if self.config.cache_mode != "off" else None,
+                replay=self.config.cache_mode == "replay",
+                collector_kwargs=self._collector_kwargs,
+            )
+            self._process_pool_key = key
+        return self._process_pool
+    
+    def close(self) -> None:
+        if self._process_pool:
+            self._process_pool.close()
+        self._chat_log.close()
+        self._response_cache.close()
     
     @property
     def config(self):
@@ -47,7 +47,7 @@ class Project(Drawable):
             json.dump(self._config, fw)
     
     def open(self):
-        self._task = None
+        self._set_task(None)
     
     def draw(self) -> None:        
         if self._task:
@@ -90,8 +90,16 @@ class Project(Drawable):
         self._config[key] = val
     
     def set_task(self, task_id: str):
-        self._task = self._task_manager.open(task_id=task_id)
+        self._set_task(self._task_manager.open(task_id=task_id))
     
     def create_task(self, task_type: str):
-        self._task = self._task_manager.create_task(task_type=task_type)
+        self._set_task(self._task_manager.create_task(task_type=task_type))
+    
+    def _set_task(self, task: Optional[Task]):
+        if self._task:
+            self._task.close()
+        self._task = task
+    
+    def close(self):
+        self._set_task(None)
     
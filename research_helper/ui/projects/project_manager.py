@@ -49,20 +49,25 @@ class ProjectManager(Drawable):
     
     def open(self, project_id: Optional[str]):
         if project_id is None:
-            self._project = None
+            self._set_project(None)
             return
         project_config = self.get_project(project_id)
         project = Project(project_id=project_config.project_id)
-        self._project = project
+        self._set_project(project)
 
     def create_project(self):
-        self._project = Project()
+        self._set_project(Project())
+    
+    def _set_project(self, project: Optional[Project]):
+        if self._project:
+            self._project.close()
+        self._project = project
     
     def reload(self):
         self._project_configs = self._load_projects()
     
     def go_home(self):
-        self._project = None
+        self._set_project(None)
     
     def draw(self):
         self.reload()
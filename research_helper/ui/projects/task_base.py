@@ -86,3 +86,6 @@ class Task(Drawable):
         self.task_path = f"projects/{project_id}/{self.task_id}"
         if not os.path.isdir(self.task_path):
             os.makedirs(self.task_path)
+    
+    def close(self) -> None:
+        """ release resources held by the task """
@@ -5,26 +5,45 @@ import streamlit as st
 
 from research_helper.schemas.trace import RunSerializable
 from research_helper.tracer.trace_log import TraceLogBase
+from research_helper.tracer.search_index import find_search_index
 from research_helper.ui.components import CSVTmpUploader
 from research_helper.ui.views.base import InteractiveRunViewBase
 from research_helper.ui.views.observer import OnserverBase, Request
-from research_helper.ui.views.requests import RUN_MODEL_REQUEST
+from research_helper.ui.views.requests import RUN_MODEL_REQUEST, RUN_BATCH_REQUEST
+from research_helper.models.batch import BatchResult, BatchProgress
+from research_helper.models.async_runner import Job
 
 class ChatView(InteractiveRunViewBase):
-    def __init__(self, input_field_keys: List[str], trace_log: TraceLogBase, observers: List[OnserverBase] = []) -> None:
+    HISTORY_PAGE_SIZE = 20
+    POLL_INTERVAL = 0.5 # seconds between redraws of running jobs
+    
+    def __init__(self, input_field_keys: List[str], trace_log: TraceLogBase, observers: List[OnserverBase] = [], history_page_size: int = HISTORY_PAGE_SIZE, run_async: bool = False) -> None:
+        """
+        Args:
+            run_async (bool): observers start the model on the AsyncRunner and hand the job to `watch`
+                instead of writing through UICallbackHandler
+        """
         super().__init__(input_field_keys, trace_log, observers)
+        self._run_async = run_async
         
         # state
         self._output_fields: Dict[str, DeltaGenerator] = {}
+        self._history_page_size = history_page_size
+        self._history_size = history_page_size # number of latest turns to render
         
-        self._input_queue = deque()
+        self._input_queue = deque() # an input, or a list of inputs which are run as one batch
+        self._jobs: List[Job] = [] # inputs running on the AsyncRunner
+        self._failed: List[Job] = [] # failed jobs, errored runs are not logged so they are kept until dismissed
         
         # components
         self._chat_container = None
         self._output_container: Optional[DeltaGenerator] = None
+        self._progress_bar: Optional[DeltaGenerator] = None
         self._csv_tmp_uploader = CSVTmpUploader(columns=self.input_field_keys)
     
     def draw(self) -> None:
+        if find_search_index(self.trace_log):
+            st.text_input("Search", placeholder='words or "a phrase"', key="chat-search", label_visibility="collapsed")
         self._chat_container = st.container(height=480, border=False)
         
         # Field: Chat
@@ -51,10 +70,55 @@ class ChatView(InteractiveRunViewBase):
                 st.button(":material/send:", on_click=self._on_file_submit)
     
     def _draw_chat(self, parent: DeltaGenerator):
+        # finished jobs are in the trace log now, each turn is drawn from one place
+        for job in [job for job in self._jobs if job.done]:
+            self._finish(job)
+            self._jobs.remove(job)
         # show chat history
         self._write_runs(parent)
+        self._write_failed(parent)
         # show new dialog
         self._write_current_dialog(parent)
+        # show running jobs, redrawn until they finish
+        if self._jobs:
+            with parent:
+                st.fragment(self._draw_jobs, run_every=self.POLL_INTERVAL)()
+    
+    def watch(self, job: Job):
+        """ show the outputs of a job as they stream in """
+        self._jobs.append(job)
+    
+    def _draw_jobs(self):
+        # the history outside of the fragment is not redrawn, so finished jobs stay here until the rerun
+        for job in self._jobs:
+            self._write_job(parent=st, job=job)
+            if job.done:
+                self._finish(job)
+        
+        if all(job.done for job in self._jobs):
+            st.rerun()
+    
+    def _write_job(self, parent: DeltaGenerator, job: Job):
+        snapshot = job.snapshot()
+        self._write_user_message(parent=parent, inputs=job.input)
+        if snapshot["error"]:
+            with parent.chat_message("assistant"):
+                st.error(snapshot["error"])
+        for model_name, output in snapshot["outputs"].items():
+            self._write_ai_message(parent=parent, outputs=output, model_name=model_name if len(snapshot["outputs"])>1 else "")
+    
+    def _finish(self, job: Job):
+        if job.snapshot()["error"] and job not in self._failed:
+            self._failed.append(job)
+            # same as error(), the rest of the queue is likely to fail the same way
+            self._input_queue.clear()
+    
+    def _write_failed(self, parent: DeltaGenerator):
+        if not self._failed: return
+        
+        for job in self._failed:
+            self._write_job(parent=parent, job=job)
+        parent.button("Dismiss errors", key="chat-dismiss-errors", on_click=self._failed.clear)
     
     def _on_submit(self):
         # get inputs from input field and push it into queue
@@ -66,16 +130,19 @@ class ChatView(InteractiveRunViewBase):
         self._input_queue.append(inputs)
     
     def _on_file_submit(self):
-        # get inputs from csv file and push them into queue
+        # get inputs from csv file and push them into queue as one batch
         if self._csv_tmp_uploader.df is not None:
             keys = [key for key in self.input_field_keys if key in self._csv_tmp_uploader.df.columns]
             inputs = self._csv_tmp_uploader.df[keys]
             # input_template = {key: "" for key in self.input_field_keys}
             input_template = {}
+            batch = []
             for idx, new_input in inputs.iterrows():
                 input = input_template.copy()
                 input.update(new_input.to_dict())
-                self._input_queue.append(input)
+                batch.append(input)
+            if batch:
+                self._input_queue.append(batch)
     
     def write(self, outputs: Dict):
         if not self._output_container: return
@@ -99,20 +166,77 @@ class ChatView(InteractiveRunViewBase):
     def update(self):
         self._write_current_dialog(parent=self._chat_container)
     
+    def write_result(self, result: BatchResult, progress: BatchProgress):
+        """ show a finished input of a batch, results come in the order they finish """
+        if not self._output_container: return
+        
+        self._write_user_message(parent=self._output_container, inputs=result.input)
+        if result.error is not None:
+            with self._output_container.chat_message("assistant"):
+                st.error(str(result.error))
+        else:
+            outputs = result.output if isinstance(result.output, dict) else {"output": result.output}
+            for model_name, output in outputs.items():
+                self._write_ai_message(parent=self._output_container, outputs=output, model_name=model_name if len(outputs)>1 else "")
+        
+        if self._progress_bar:
+            eta = f", {progress.eta:.0f}s left" if progress.eta is not None else ""
+            self._progress_bar.progress(
+                progress.done/progress.total,
+                text=f"{progress.done}/{progress.total} done, {progress.errors} errors, {progress.throughput:.2f} inputs/s{eta}",
+            )
+    
     def _write_run(self, parent: DeltaGenerator, run: RunSerializable):
         self._write_user_message(parent=parent, inputs=run.inputs)
-        for model_name, output in run.outputs.items():
+        if run.error:
+            with parent.chat_message("assistant"):
+                st.error(run.error)
+        for model_name, output in (run.outputs or {}).items():
             self._write_ai_message(parent=parent, outputs=output, model_name=model_name if len(run.outputs)>1 else "")
         
     def _write_runs(self, parent: DeltaGenerator):
-        for trace in self.trace_log.get_trace():
+        if (query := st.session_state.get("chat-search")) and (index := find_search_index(self.trace_log)):
+            # render only the latest matched turns
+            for trace in index.search_traces(query, limit=self._history_size):
+                self._write_run(parent=parent, run=trace)
+            return
+        
+        # render only the latest turns, older ones are loaded on demand
+        offset = max(self.trace_log.count()-self._history_size, 0)
+        if offset > 0:
+            parent.button("Load older", key="chat-load-older", on_click=self._load_older)
+        
+        for trace in self.trace_log.get_trace(offset=offset):
             self._write_run(parent=parent, run=trace)
     
+    def _load_older(self):
+        self._history_size += self._history_page_size
+    
     def _write_current_dialog(self, parent: DeltaGenerator):
         if not len(self._input_queue)>0: return
         
         with parent:
             input = self._input_queue.popleft()
+            if isinstance(input, list):
+                self._progress_bar = st.progress(0.0, text=f"0/{len(input)} done")
+                self._output_container = st.container() # placeholder for the finished inputs
+                self.notify(
+                    Request(
+                        name=RUN_BATCH_REQUEST,
+                        value=input,
+                    )
+                )
+                return
+            
+            if self._run_async:
+                # queued inputs are submitted at once and shown by _draw_jobs
+                inputs = [input]
+                while self._input_queue and not isinstance(self._input_queue[0], list):
+                    inputs.append(self._input_queue.popleft())
+                for input in inputs:
+                    self.notify(Request(name=RUN_MODEL_REQUEST, value=input))
+                return
+            
             self._write_user_message(parent=parent, inputs=input)
             self._output_fields = {} # clear previous output_fields
             self._output_container = st.container() # placeholder for ai putput
@@ -1 +1,2 @@
-RUN_MODEL_REQUEST = "run_model_request"
\ No newline at end of file
+RUN_MODEL_REQUEST = "run_model_request"
+RUN_BATCH_REQUEST = "run_batch_request"
\ No newline at end of file
@@ -1,54 +1,45 @@
-from typing import Any, Dict, List, Optional, Callable, Sequence
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional
 import streamlit as st
 import pandas as pd
 
-from langchain_core.messages.base import BaseMessage
-from langchain_core.prompt_values import PromptValue
-
-from research_helper.tracer.trace_log import TraceLogBase
+from research_helper.dataframe.flatten import flatten
+from research_helper.dataframe.latency_profile import LatencyProfile
 from research_helper.schemas.run import RunSerializable
+from research_helper.tracer.trace_log import TraceLogBase
+from research_helper.tracer.search_index import find_search_index
 from research_helper.ui.views.base import RunViewBase
 from research_helper.ui.views.observer import OnserverBase, Request
 
-def get_recursively(run: RunSerializable, target: str, prefix="", default: Callable=lambda x: x):
-    # get target from current run
-    targets = getattr(run, target)
-    prefix += run.name if prefix=="" else f"-{run.name}"
-    
-    items = {}
-    if isinstance(targets, dict):
-        for key, item in targets.items():
-            items[prefix+"_"+target+"-"+key] = default(item)
-    else:
-        items[prefix+"_"+target] = default(targets)
-    
-    # aquire target from children
-    for child in run.child_runs:
-        items.update(get_recursively(run=child, target=target, prefix=prefix, default=default))
-    
-    return items
-
-def serialize(target: Any) -> str:
-    if isinstance(target, str):
-        return target
-    elif isinstance(target, BaseMessage):
-        return target.pretty_repr()
-    elif isinstance(target, PromptValue):
-        return target.to_string()
-    elif isinstance(target, Sequence):
-        return [serialize(t) for t in target]
-    else:
-        return str(target)
-
 class TableView(RunViewBase):
     SELECT_COLUMN = "__selected"
     
-    def __init__(self, trace_log: TraceLogBase) -> None:
+    def __init__(self, trace_log: TraceLogBase, max_rows: int = 256) -> None:
+        """
+        Args:
+            max_rows (int): only the latest traces are shown, older ones are left in the log
+        """
         super().__init__(trace_log)
         self._table: pd.DataFrame = None
+        self.max_rows = max_rows
+        self._rows: Deque[Dict[str, Any]] = deque() # flattened traces, extended only with new ones
+        self._read = 0 # offset of the next trace to read from the log
+        self._query = "" # search shown in the table
+        self._profile = LatencyProfile() # covers every trace of the log up to _profiled
+        self._profiled = 0
     
     def draw(self) -> None:
         runs_df = self.table
+        if index := find_search_index(self.trace_log):
+            self._query = st.text_input("Search", placeholder='words or "a phrase"', key="table-search")
+            if query := self._query:
+                # hits may be older than the rows in the table
+                rows = [
+                    {TableView.SELECT_COLUMN: True, **flatten(run)}
+                    for run in index.search_traces(query, limit=self.max_rows)
+                ]
+                # an empty frame keeps the columns of the table
+                runs_df = pd.DataFrame(data=rows) if rows else runs_df.iloc[0:0]
         self._table = st.data_editor(
             runs_df,
             column_config={
@@ -67,15 +58,48 @@ class TableView(RunViewBase):
         if TableView.SELECT_COLUMN not in self._table.columns: return None
         return self._table[self._table[TableView.SELECT_COLUMN]==True]
     
+    @property
+    def truncated(self) -> bool:
+        """ whether the log holds traces older than the rows of the table """
+        return self._read > len(self._rows) and not self._query
+    
+    def export(self, batch_size: int = 256) -> pd.DataFrame:
+        """ every trace of the log as a row of the table, except the rows unselected in the table """
+        unselected = set()
+        if self._table is not None and {TableView.SELECT_COLUMN, "id"} <= set(self._table.columns):
+            unselected = set(self._table.loc[self._table[TableView.SELECT_COLUMN]==False, "id"].astype(str))
+        
+        rows = []
+        for batch in self._pages(0, batch_size):
+            rows.extend({TableView.SELECT_COLUMN: True, **flatten(run)} for run in batch if str(run.id) not in unselected)
+        return pd.DataFrame(data=rows)
+    
+    def _pages(self, offset: int, batch_size: int) -> Iterator[List[RunSerializable]]:
+        """ traces of the log from offset on, a batch at a time so that a long log is never held at once """
+        count = self.trace_log.count()
+        while offset < count and (batch := self.trace_log.get_trace(offset=offset, limit=min(batch_size, count-offset))):
+            yield batch
+            offset += len(batch)
+    
     @property
     def table(self) -> pd.DataFrame:
-        return pd.DataFrame(data=[
-            {
-                TableView.SELECT_COLUMN: True,
-                "id": run.id,
-                **get_recursively(run, "inputs", default=serialize),
-                **get_recursively(run, "outputs", default=serialize),
-            }
-            for run in self.trace_log.get_trace()
-        ])
+        self._update()
+        return pd.DataFrame(data=self._rows)
+    
+    @property
+    def latency(self) -> LatencyProfile:
+        """ profile of every trace of the log, only traces added since the last call are read """
+        for batch in self._pages(self._profiled, 256):
+            self._profile.extend(batch)
+            self._profiled += len(batch)
+        return self._profile
+    
+    def _update(self) -> None:
+        # traces which would not fit into the table are never read, so opening a long log stays cheap
+        offset = max(self._read, self.trace_log.count()-self.max_rows)
+        runs = self.trace_log.get_trace(offset=offset)
+        self._read = offset+len(runs)
+        self._rows.extend({TableView.SELECT_COLUMN: True, **flatten(run)} for run in runs)
+        while len(self._rows) > self.max_rows:
+            self._rows.popleft()
         
\ No newline at end of file
@@ -0,0 +1,29 @@
+import uuid
+from datetime import datetime
+
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+from langchain_core.tracers.schemas import Run
+
+from research_helper.tracer.experiment_tracer import ExperimentTracer, token_usage
+
+USAGE = {"prompt_tokens": 3, "completion_tokens": 5, "total_tokens": 8}
+
+def chat_result() -> LLMResult:
+    message = AIMessage(content="hello", usage_metadata={"input_tokens": 3, "output_tokens": 5, "total_tokens": 8})
+    return LLMResult(generations=[[ChatGeneration(message=message)]])
+
+def test_token_usage_of_dumped_result():
+    run = Run(
+        id=uuid.uuid4(), name="chat", run_type="llm", inputs={}, start_time=datetime.now(),
+        outputs=chat_result().dict(),
+    )
+    assert token_usage(run) == USAGE
+
+def test_token_usage_of_traced_chat_model():
+    tracer = ExperimentTracer()
+    run_id = uuid.uuid4()
+    # the callback manager falls back to on_llm_start for chat models, as BaseTracer has no on_chat_model_start
+    tracer.on_llm_start({"name": "chat"}, ["hi"], run_id=run_id, name="chat")
+    tracer.on_llm_end(chat_result(), run_id=run_id)
+    assert tracer.snapshot()["by_name"]["chat"]["tokens"] == USAGE
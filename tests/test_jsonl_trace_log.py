@@ -0,0 +1,44 @@
+import uuid
+from datetime import datetime
+
+from streamlit.testing.v1 import AppTest
+
+from research_helper.schemas.run import RunSerializable
+from research_helper.tracer.run_codec import RunCodec
+from research_helper.tracer.jsonl_trace_log import TraceLazyLog
+
+def make_run(text: str) -> RunSerializable:
+    return RunSerializable(
+        id=uuid.uuid4(), name="model", run_type="chain", start_time=datetime.now(),
+        inputs={"input": text}, outputs={"output": text},
+    )
+
+def write_log(path, lines):
+    with open(path, mode="w", encoding="utf-8") as log_file:
+        log_file.write("".join(lines))
+
+def test_corrupt_line_keeps_offsets(tmp_path):
+    codec = RunCodec()
+    log_path = tmp_path/"chat.log"
+    write_log(log_path, [codec.dumps(make_run("r1")), '{"id": "not a run"}\n', codec.dumps(make_run("r3"))])
+
+    log = TraceLazyLog(str(log_path))
+    traces = log.get_trace()
+    assert log.count() == len(traces) == 3
+    assert [trace.outputs for trace in traces] == [{"output": "r1"}, {}, {"output": "r3"}]
+    assert traces[1].error
+    assert [trace.inputs.get("input") for trace in log.get_trace(offset=2, limit=1)] == ["r3"]
+
+def _chat_app(log_path: str):
+    from research_helper.tracer.jsonl_trace_log import TraceLazyLog
+    from research_helper.ui.views.chat_view import ChatView
+
+    ChatView(["input"], trace_log=TraceLazyLog(log_path)).draw()
+
+def test_chat_view_renders_corrupt_line(tmp_path):
+    log_path = tmp_path/"chat.log"
+    write_log(log_path, [RunCodec().dumps(make_run("r1")), '{"id": "not a run"}\n'])
+
+    app = AppTest.from_function(_chat_app, args=(str(log_path),)).run()
+    assert not app.exception
+    assert len(app.error) == 1
@@ -0,0 +1,31 @@
+import uuid
+from datetime import datetime, timedelta
+
+from research_helper.dataframe.latency_profile import covered_time
+from research_helper.schemas.run import RunSerializable
+from research_helper.tracer.trace_log import TraceLog
+from research_helper.ui.views.table_view import TableView
+
+def test_covered_time_skips_clipped_intervals():
+    # a child which started after its parent ended is clipped to (parent end, child end) reversed
+    assert covered_time([(0.0, 1.0), (3.0, 2.0), (0.5, 1.5)]) == 1.5
+
+def make_trace(seconds: float) -> RunSerializable:
+    start = datetime(2024, 1, 1)
+    return RunSerializable(
+        id=uuid.uuid4(), name="chain", run_type="chain", start_time=start, end_time=start+timedelta(seconds=seconds),
+        inputs={}, outputs={},
+    )
+
+def test_latency_covers_traces_beyond_the_table(tmp_path):
+    log = TraceLog(str(tmp_path/"chat.json"))
+    for _ in range(5):
+        log.add_trace(make_trace(1.0))
+    view = TableView(log, max_rows=2)
+    assert len(view.table) == 2
+    assert view.latency.traces == 5
+
+    log.add_trace(make_trace(2.0))
+    latency = view.latency.to_dataframe()
+    assert latency["calls"].tolist() == [6]
+    assert latency["total_time"].tolist() == [7.0]
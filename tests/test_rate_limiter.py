@@ -0,0 +1,46 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.runnables import RunnableLambda
+
+from research_helper.models.rate_limiter import RateLimiter, RateLimitedModel
+
+def sleep(text: str) -> str:
+    time.sleep(0.05)
+    return text
+
+async def sleep_async(text: str) -> str:
+    await asyncio.sleep(0.05)
+    return text
+
+def test_queued_coroutines_hold_no_thread():
+    limiter = RateLimiter(max_in_flight=2)
+    model = RateLimitedModel(RunnableLambda(sleep, afunc=sleep_async), limiter)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=2))
+        outputs = asyncio.gather(*[model.ainvoke(str(idx)) for idx in range(20)])
+        await asyncio.sleep(0.01)
+        # the calls waiting for a slot leave the executor to others
+        await asyncio.wait_for(loop.run_in_executor(None, lambda: None), timeout=0.1)
+        return await outputs
+
+    assert asyncio.run(run()) == [str(idx) for idx in range(20)]
+    assert limiter.snapshot()["max_in_flight"] == 2
+
+def test_slots_are_shared_by_threads_and_coroutines():
+    limiter = RateLimiter(max_in_flight=1)
+    model = RateLimitedModel(RunnableLambda(sleep, afunc=sleep_async), limiter)
+
+    async def run():
+        return await asyncio.wait_for(asyncio.gather(*[model.ainvoke("async") for _ in range(3)]), timeout=5)
+
+    thread = threading.Thread(target=lambda: [model.invoke("sync") for _ in range(3)])
+    thread.start()
+    assert asyncio.run(run()) == ["async"]*3
+    thread.join()
+    assert limiter.snapshot()["max_in_flight"] == 1
+    assert limiter.snapshot()["calls"] == 6
@@ -0,0 +1,27 @@
+import uuid
+from datetime import datetime, timezone
+
+from langchain_core.messages import AIMessage
+
+from research_helper.schemas.run import RunSerializable
+from research_helper.tracer.run_codec import RunCodec
+
+def make_trace() -> RunSerializable:
+    root_id = uuid.uuid4()
+    message = AIMessage(content="answer")
+    child = RunSerializable(
+        id=uuid.uuid4(), name="model", run_type="llm", start_time=datetime.now(timezone.utc),
+        parent_run_id=root_id, outputs={"message": message},
+    )
+    return RunSerializable(
+        id=root_id, name="chain", run_type="chain", start_time=datetime.now(), end_time=datetime.now(),
+        inputs={"question": "q"}, outputs={"message": message}, child_runs=[child], tags=["a"],
+    )
+
+def test_trusted_loads_matches_validation():
+    line = RunCodec().dumps(make_trace()).encode("utf-8")
+    trusted, validated = RunCodec().loads(line), RunCodec(trusted=False).loads(line)
+
+    assert trusted == validated
+    assert isinstance(trusted.child_runs[0].outputs["message"], AIMessage)
+    assert RunCodec().dumps(trusted).encode("utf-8") == line
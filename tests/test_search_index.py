@@ -0,0 +1,57 @@
+import uuid
+from datetime import datetime
+
+from research_helper.schemas.run import RunSerializable
+from research_helper.tracer.jsonl_trace_log import TraceLazyLog
+from research_helper.tracer.search_index import TraceSearchIndexLog
+
+def make_trace(question: str, answer: str, hidden: str = "") -> RunSerializable:
+    root_id = uuid.uuid4()
+    child = RunSerializable(
+        id=uuid.uuid4(), name="prompt", run_type="prompt", start_time=datetime.now(), parent_run_id=root_id,
+        inputs={"context": hidden}, outputs={},
+    )
+    return RunSerializable(
+        id=root_id, name="chain", run_type="chain", start_time=datetime.now(),
+        inputs={"question": question}, outputs={"output": answer}, child_runs=[child],
+    )
+
+def open_log(tmp_path) -> TraceSearchIndexLog:
+    return TraceSearchIndexLog(TraceLazyLog(str(tmp_path/"chat.log")), index_path=str(tmp_path/"chat.index"))
+
+def test_index_is_built_on_first_search(tmp_path):
+    log = open_log(tmp_path)
+    log.add_trace(make_trace("where is the red fox", "in the forest", hidden="secret"))
+    log.add_trace(make_trace("東京の天気", "晴れ"))
+    log.save()
+    assert len(log._index) == 0 # nothing is indexed before a search
+
+    assert [trace.inputs["question"] for trace in log.search_traces('"red fox"')] == ["where is the red fox"]
+    assert log.search('"fox red"') == []
+    assert len(log.search("天気")) == 1
+    assert log.search("secret") == [] # only the root inputs/outputs are indexed
+
+    log.add_trace(make_trace("another fox", "here"))
+    assert len(log.search("fox")) == 2
+    log.close()
+
+def test_reopened_index_catches_up(tmp_path):
+    log = open_log(tmp_path)
+    log.add_trace(make_trace("first question", "answer"))
+    assert len(log.search("question")) == 1
+    log.close()
+
+    log = TraceLazyLog(str(tmp_path/"chat.log"))
+    log.add_trace(make_trace("second question", "answer"))
+    log.save()
+
+    log = open_log(tmp_path)
+    assert [trace.inputs["question"] for trace in log.search_traces("question")] == ["first question", "second question"]
+    log.close()
+
+def test_legacy_index_is_rebuilt(tmp_path):
+    (tmp_path/"chat.index").write_text('{"id": "x", "terms": {"question": [0]}}\n', encoding="utf-8")
+    log = open_log(tmp_path)
+    log.add_trace(make_trace("a question", "answer"))
+    assert len(log.search("question")) == 1
+    log.close()
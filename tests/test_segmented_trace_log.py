@@ -0,0 +1,31 @@
+import os
+import uuid
+from datetime import datetime
+
+from research_helper.schemas.run import RunSerializable
+from research_helper.tracer.segmented_trace_log import TraceSegmentedLog
+
+def make_run(text: str) -> RunSerializable:
+    return RunSerializable(
+        id=uuid.uuid4(), name="model", run_type="chain", start_time=datetime.now(),
+        inputs={"input": text}, outputs={"output": text},
+    )
+
+def test_corrupt_line_keeps_pages(tmp_path):
+    log = TraceSegmentedLog(str(tmp_path), max_runs=2, compression="gzip")
+    for text in ["r1", "r2", "r3"]:
+        log.add_trace(make_run(text))
+        log.save()
+
+    active_path = str(tmp_path/"segment-000001.jsonl")
+    assert os.path.exists(active_path)
+    with open(active_path, mode="ab") as segment_file:
+        segment_file.write(b'{"id": "not a run"}\n')
+    log = TraceSegmentedLog(str(tmp_path), max_runs=10, compression="gzip")
+    log.add_trace(make_run("r5"))
+
+    traces = log.get_trace()
+    assert log.count() == len(traces) == 5
+    assert [trace.inputs.get("input") for trace in traces] == ["r1", "r2", "r3", None, "r5"]
+    assert traces[3].error and traces[3].outputs == {}
+    assert [trace.inputs.get("input") for trace in log.get_trace(offset=4, limit=1)] == ["r5"]
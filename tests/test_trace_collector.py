@@ -0,0 +1,29 @@
+import time
+from typing import Optional
+
+from langchain_core.runnables import RunnableLambda
+
+from research_helper.tracer.trace_collector import TraceCollectorCallbackHandler
+from research_helper.tracer.trace_log import TraceLog
+
+def step(text: str) -> str:
+    if text == "error":
+        # the errored child run is recovered by the fallback, so the trace still has outputs
+        return RunnableLambda(lambda text: 1/0).with_fallbacks([RunnableLambda(lambda text: text)]).invoke(text)
+    if text == "slow":
+        time.sleep(0.2)
+    return text
+
+def collect(tmp_path, sample_rate: float, slow_threshold: Optional[float]):
+    log = TraceLog(str(tmp_path/"chat.json"))
+    collector = TraceCollectorCallbackHandler(log=log, sample_rate=sample_rate, slow_threshold=slow_threshold)
+    chain = RunnableLambda(lambda text: text) | RunnableLambda(step)
+    for text in ["fast", "slow", "error"]:
+        chain.invoke(text, config={"callbacks": [collector]})
+    return {trace.inputs["input"]: len(trace.child_runs) for trace in log.get_trace()}
+
+def test_unsampled_traces_keep_slow_and_errored_in_full(tmp_path):
+    assert collect(tmp_path, sample_rate=0.0, slow_threshold=0.1) == {"fast": 0, "slow": 2, "error": 2}
+
+def test_sampled_traces_keep_child_runs(tmp_path):
+    assert collect(tmp_path, sample_rate=1.0, slow_threshold=None) == {"fast": 2, "slow": 2, "error": 2}